@@ -3,62 +3,275 @@
 """Recipe nginx"""
 
 import os
+import re
 import pwd
+import json
 import stat
+import time
+import datetime
+import ipaddress
+import tempfile
+import glob
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copy2
 from uuid import uuid4
 from mako.template import Template
 import logging
 
 import zc.buildout
+import zc.recipe.egg
+from zc.buildout.buildout import bool_option
 import zc.recipe.deployment
 from zc.recipe.deployment import Configuration
-from zc.recipe.deployment import make_dir
 import birdhousebuilder.recipe.conda
 from birdhousebuilder.recipe import supervisor
-from birdhousebuilder.recipe.nginx._compat import urlretrieve
+from birdhousebuilder.recipe.nginx._render import Manifest
+from birdhousebuilder.recipe.nginx._render import load_template
+from birdhousebuilder.recipe.nginx._render import fingerprint
+from birdhousebuilder.recipe.nginx._render import file_state
+from birdhousebuilder.recipe.nginx import _snippets
+from birdhousebuilder.recipe.nginx import _tuning
+from birdhousebuilder.recipe.nginx import _precompress
+from birdhousebuilder.recipe.nginx import _assets
+from birdhousebuilder.recipe.nginx import _fetch
+from birdhousebuilder.recipe.nginx import _control
+from birdhousebuilder.recipe.nginx import _conda
+from birdhousebuilder.recipe.nginx import lint
 
-templ_config = Template(filename=os.path.join(os.path.dirname(__file__), "nginx.conf"))
+templ_config_file = os.path.join(os.path.dirname(__file__), "nginx.conf")
+templ_logrotate_file = os.path.join(os.path.dirname(__file__), "rotate-logs.sh")
+templ_status_file = os.path.join(os.path.dirname(__file__), "status.conf")
 templ_cmd = Template(
     '${conda_prefix}/sbin/nginx -p ${prefix} -c ${etc_prefix}/nginx/nginx.conf -g "daemon off;"')
+templ_tmpfs_cmd = Template("/bin/sh -c 'mkdir -p ${temp_directory} && exec ${command}'")
+templ_exporter_cmd = Template(
+    '${bin_directory}/nginx-exporter --status ${status_url} --listen ${status_exporter_listen}')
 
+TEMP_PATHS = ['client_body', 'proxy', 'fastcgi', 'uwsgi', 'scgi']
 
-def make_dirs(name, user, mode=0o755):
-    etc_uid, etc_gid = pwd.getpwnam(user)[2:4]
+DEFAULT_TUNING = {
+    'worker-processes': '1',
+    'worker-connections': '1024',
+    'worker-rlimit-nofile': '',
+    'worker-cpu-affinity': '',
+    'events-use': '',
+    'multi-accept': 'off',
+}
+
+
+_user_ids = {}
+
+
+def user_ids(user):
+    """Returns (uid, gid) of ``user``. Lookups are cached for the buildout run."""
+    if user not in _user_ids:
+        _user_ids[user] = tuple(pwd.getpwnam(user)[2:4])
+    return _user_ids[user]
+
+
+def make_tree(dirs):
+    """
+    Creates the directories given as (path, user, mode) tuples in one pass.
+
+    Parents have to come before their children. Mode and owner of existing
+    directories are only changed when they differ. Returns the created directories.
+    """
     created = []
-    make_dir(name, etc_uid, etc_gid, mode, created)
+    for path, user, mode in dirs:
+        uid, gid = user_ids(user)
+        try:
+            st = os.stat(path)
+        except OSError:
+            os.makedirs(path, mode)
+            created.append(path)
+            st = os.stat(path)
+        if stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(path, mode)
+        if (st.st_uid, st.st_gid) != (uid, gid):
+            os.chown(path, uid, gid)
+    return created
+
+
+def make_dirs(name, user, mode=0o755):
+    make_tree([(name, user, mode)])
+
+
+def status_url(listen, path):
+    """
+    Returns the url of the stub_status location for the ``status-listen`` address.
+
+    The address has to be a unix socket or on the loopback interface.
+    """
+    if listen.startswith('unix:'):
+        return 'http://%s:%s' % (listen, path)
+    host, _, port = listen.rpartition(':')
+    if not port.isdigit():
+        raise zc.buildout.UserError("status-listen needs a port or unix socket: %s" % listen)
+    try:
+        loopback = host == 'localhost' or ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise zc.buildout.UserError("status-listen has to be a loopback address or unix socket: %s" % listen)
+    return 'http://%s%s' % (listen, path)
 
 
-def generate_cert(out, org, org_unit, hostname, key_length=1024):
+def add_zone(zones, zone, kind):
+    """
+    Adds ``zone``, a tuple starting with the zone name, to ``zones`` unless it is there.
+    nginx shares the names of all zones, different zones with one name are an error.
+    """
+    for other in zones:
+        if other == zone:
+            return
+        if other[0] == zone[0]:
+            raise zc.buildout.UserError("The %s zone %s conflicts with another zone of that name." % (kind, zone[0]))
+    zones.append(zone)
+
+
+def site_filename(name):
+    """Returns the ``conf.d`` filename for a site name or template path."""
+    name = os.path.basename(name)
+    for suffix in ('.mako', '.tmpl', '.in'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if not name.endswith('.conf'):
+        name += '.conf'
+    return name
+
+
+KEY_PATTERN = re.compile(br'-----BEGIN [A-Z ]*PRIVATE KEY-----.+?-----END [A-Z ]*PRIVATE KEY-----\s*', re.DOTALL)
+
+
+def generate_key(key_type='rsa', key_length=1024):
+    """
+    Generates a private key: RSA with ``key_length`` bits or an ECDSA P-256 key.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    if key_type == 'ec':
+        return ec.generate_private_key(ec.SECP256R1(), default_backend())
+    elif key_type == 'rsa':
+        return rsa.generate_private_key(65537, key_length, default_backend())
+    raise ValueError("unknown key type: %s" % key_type)
+
+
+def key_type_of(key):
+    from cryptography.hazmat.primitives.asymmetric import ec
+    return 'ec' if isinstance(key, ec.EllipticCurvePrivateKey) else 'rsa'
+
+
+def read_cert(path):
+    """
+    Reads a PEM file with certificate and private key.
+
+    Returns a tuple (certificate, key), each is None when missing or invalid.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    try:
+        cert = x509.load_pem_x509_certificate(data, default_backend())
+    except ValueError:
+        cert = None
+    match = KEY_PATTERN.search(data)
+    try:
+        key = serialization.load_pem_private_key(match.group(0), None, default_backend()) if match else None
+    except (ValueError, TypeError):
+        key = None
+    return cert, key
+
+
+def cert_expires(cert):
+    """Returns the expiry date of ``cert`` as naive UTC datetime."""
+    if hasattr(cert, 'not_valid_after_utc'):
+        return cert.not_valid_after_utc.replace(tzinfo=None)
+    return cert.not_valid_after
+
+
+def subject_alt_names(hostname, alt_names=None):
+    """Returns the subject alternative names for ``hostname`` and ``alt_names``."""
+    from cryptography import x509
+    names = []
+    for name in [hostname] + list(alt_names or []):
+        try:
+            entry = x509.IPAddress(ipaddress.ip_address(name))
+        except ValueError:
+            entry = x509.DNSName(name)
+        if entry not in names:
+            names.append(entry)
+    return names
+
+
+def cert_matches(cert, hostname, alt_names=None):
+    """Returns True when ``cert`` is issued for ``hostname`` and exactly ``alt_names``."""
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    common_names = [attr.value for attr in cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)]
+    try:
+        names = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    except x509.ExtensionNotFound:
+        names = []
+    return common_names == [hostname] and set(names) == set(subject_alt_names(hostname, alt_names))
+
+
+def generate_cert(out, org, org_unit, hostname, key_length=1024, key_type='rsa', days=365,
+                  alt_names=None, key=None):
     """
     Generates self signed certificate for https connections.
 
+    The certificate is valid for ``days`` and for ``hostname`` and ``alt_names``
+    (host names or IP addresses). An existing ``key`` is reused, otherwise a new
+    key of ``key_type`` is generated. Certificate and key are written atomically
+    to ``out``, readable only by the owner.
+
     Returns True on success.
     """
     try:
-        from OpenSSL import crypto
-        k = crypto.PKey()
-        k.generate_key(crypto.TYPE_RSA, key_length)
-        cert = crypto.X509()
-        cert.get_subject().O = org
-        cert.get_subject().OU = org_unit
-        cert.get_subject().CN = hostname
-        sequence = int(uuid4().hex, 16)
-        cert.set_serial_number(sequence)
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes, serialization
+        if key is None:
+            key = generate_key(key_type, key_length)
+        subject = x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, org),
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, org_unit),
+            x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+        names = subject_alt_names(hostname, alt_names)
         # valid right now
-        cert.gmtime_adj_notBefore(0)
-        # valid for 365 days
-        cert.gmtime_adj_notAfter(31536000)
-        cert.set_issuer(cert.get_subject())
-        cert.set_pubkey(k)
-        cert.sign(k, 'sha256')
-        # write to cert and key to same file
-        open(out, "wb").write(
-            crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
-        open(out, "ab").write(
-            crypto.dump_privatekey(crypto.FILETYPE_PEM, k))
-        # TODO: fix permissions  ... nginx is run by unpriviledged user.
-        # os.chmod(out, stat.S_IRUSR|stat.S_IWUSR)
+        now = datetime.datetime.utcnow()
+        cert = x509.CertificateBuilder().subject_name(
+            subject
+        ).issuer_name(
+            subject
+        ).public_key(
+            key.public_key()
+        ).serial_number(
+            int(uuid4().hex, 16)
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + datetime.timedelta(days=days)
+        ).add_extension(
+            x509.SubjectAlternativeName(names), critical=False
+        ).sign(key, hashes.SHA256(), default_backend())
+        # write cert and key to same file
+        data = cert.public_bytes(serialization.Encoding.PEM) + key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption())
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out)))
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IWUSR)
+            os.rename(tmp, out)
+        except Exception:
+            os.remove(tmp)
+            raise
     except Exception:
         print("Certificate generation has failed!")
         return False
@@ -104,9 +317,21 @@ class Recipe(object):
         self.options['cache-directory'] = self.options['cache_directory'] = self.deployment.options['cache-directory']
         self.prefix = self.options['prefix']
 
+        # recipe state: compiled templates and manifest of rendered files
+        self.part_directory = os.path.join(b_options['parts-directory'], name)
+        self.template_cache = os.path.join(self.part_directory, 'templates')
+        self.manifest = None
+        self.timings = []
+
         # conda environment path
         self.options['env'] = self.options.get('env', '')
         self.options['pkgs'] = self.options.get('pkgs', 'nginx openssl pyopenssl cryptography')
+        # pin an exact nginx build, e.g. nginx-version = 1.19.6 and nginx-build = h1234_0
+        self.options['nginx-version'] = self.options['nginx_version'] = self.options.get('nginx-version', '')
+        self.options['nginx-build'] = self.options['nginx_build'] = self.options.get('nginx-build', '')
+        if self.options['nginx-version'] or self.options['nginx-build']:
+            self.options['pkgs'] = ' '.join(_conda.pin(
+                self.options['pkgs'].split(), 'nginx', self.options['nginx-version'], self.options['nginx-build']))
         self.options['channels'] = self.options.get('channels', 'defaults birdhouse')
         self.conda = birdhousebuilder.recipe.conda.Recipe(self.buildout, self.name, {
             'env': self.options['env'],
@@ -118,13 +343,76 @@ class Recipe(object):
         self.options['hostname'] = self.options.get('hostname', 'localhost')
         self.options['http-port'] = self.options['http_port'] = self.options.get('http-port', '80')
         self.options['https-port'] = self.options['https_port'] = self.options.get('https-port', '443')
-        self.options['worker-processes'] = self.options['worker_processes'] = self.options.get('worker-processes', '1')
+        # applying config changes to a running nginx
+        self.options['graceful-reload'] = self.options['graceful_reload'] = \
+            self.options.get('graceful-reload', 'true')
+        self.options['binary-upgrade'] = self.options['binary_upgrade'] = self.options.get('binary-upgrade', 'false')
+        # workers and events: host-aware defaults with auto-tune, explicit options win
+        self.options['auto-tune'] = self.options['auto_tune'] = self.options.get('auto-tune', 'false')
+        if bool_option(self.options, 'auto-tune', False):
+            tuned = _tuning.auto_tune()
+        else:
+            tuned = DEFAULT_TUNING
+        self.options['worker-processes'] = self.options['worker_processes'] = \
+            self.options.get('worker-processes', tuned['worker-processes'])
+        self.options['worker-connections'] = self.options['worker_connections'] = \
+            self.options.get('worker-connections', tuned['worker-connections'])
+        self.options['worker-rlimit-nofile'] = self.options['worker_rlimit_nofile'] = \
+            self.options.get('worker-rlimit-nofile', tuned['worker-rlimit-nofile'])
+        self.options['worker-cpu-affinity'] = self.options['worker_cpu_affinity'] = \
+            self.options.get('worker-cpu-affinity', tuned['worker-cpu-affinity'])
+        self.options['events-use'] = self.options['events_use'] = self.options.get('events-use', tuned['events-use'])
+        self.options['multi-accept'] = self.options['multi_accept'] = \
+            self.options.get('multi-accept', tuned['multi-accept'])
+        # generated listeners
+        self.options['reuseport'] = self.options.get('reuseport', 'false')
+        self.options['http2'] = self.options.get('http2', 'false')
+        self.listen_options(self.options)
         self.options['keepalive-timeout'] = self.options['keepalive_timeout'] = \
             self.options.get('keepalive-timeout', '5s')
-        self.options['sendfile'] = self.options.get('sendfile', 'off')
+        # temp files and request/response buffering
+        if bool_option(self.options, 'temp-tmpfs', False):
+            default_temp = os.path.join('/dev/shm', 'nginx-' + self.name)
+        else:
+            default_temp = os.path.join(self.options['var-prefix'], 'tmp', 'nginx')
+        self.options['temp-directory'] = self.options['temp_directory'] = \
+            self.options.get('temp-directory', default_temp)
+        for option in ('client-max-body-size', 'client-body-buffer-size', 'proxy-buffers', 'proxy-buffer-size',
+                       'proxy-busy-buffers-size', 'proxy-request-buffering', 'proxy-buffering'):
+            self.options[option] = self.options[option.replace('-', '_')] = self.options.get(option, '')
+        self.options['proxy-streaming'] = self.options['proxy_streaming'] = _snippets.proxy_streaming()
+        # static file serving profile, explicit options win
+        self.options['static-profile'] = self.options['static_profile'] = self.options.get('static-profile', 'off')
+        if self.options['static-profile'] not in _tuning.STATIC_PROFILES:
+            raise zc.buildout.UserError("Unknown static-profile: %s" % self.options['static-profile'])
+        static = _tuning.STATIC_PROFILES[self.options['static-profile']]
+        self.options['sendfile'] = self.options.get('sendfile', static['sendfile'])
+        self.options['sendfile-max-chunk'] = self.options['sendfile_max_chunk'] = \
+            self.options.get('sendfile-max-chunk', static['sendfile-max-chunk'])
+        self.options['tcp-nopush'] = self.options['tcp_nopush'] = self.options.get('tcp-nopush', static['tcp-nopush'])
+        self.options['tcp-nodelay'] = self.options['tcp_nodelay'] = \
+            self.options.get('tcp-nodelay', static['tcp-nodelay'])
+        self.options['open-file-cache-max'] = self.options['open_file_cache_max'] = \
+            self.options.get('open-file-cache-max', static['open-file-cache-max'])
+        self.options['open-file-cache-inactive'] = self.options['open_file_cache_inactive'] = \
+            self.options.get('open-file-cache-inactive', static['open-file-cache-inactive'])
+        self.options['open-file-cache-valid'] = self.options['open_file_cache_valid'] = \
+            self.options.get('open-file-cache-valid', static['open-file-cache-valid'])
+        self.options['open-file-cache-min-uses'] = self.options['open_file_cache_min_uses'] = \
+            self.options.get('open-file-cache-min-uses', static['open-file-cache-min-uses'])
+        self.options['output-buffers'] = self.options['output_buffers'] = \
+            self.options.get('output-buffers', static['output-buffers'])
         self.options['organization'] = self.options.get('organization', 'Birdhouse')
         self.options['organization-unit'] = self.options.get('organization-unit', 'Demo')
         self.options['ssl-key-length'] = self.options['ssl_key_length'] = self.options.get('ssl-key-length', '1024')
+        self.options['ssl-key-type'] = self.options['ssl_key_type'] = self.options.get('ssl-key-type', 'rsa')
+        if self.options['ssl-key-type'] not in ('rsa', 'ec'):
+            raise zc.buildout.UserError("Unknown ssl-key-type: %s" % self.options['ssl-key-type'])
+        self.options['ssl-cert-days'] = self.options['ssl_cert_days'] = self.options.get('ssl-cert-days', '365')
+        self.options['ssl-cert-renew-days'] = self.options['ssl_cert_renew_days'] = \
+            self.options.get('ssl-cert-renew-days', '30')
+        self.options['ssl-subject-alt-names'] = self.options['ssl_subject_alt_names'] = \
+            self.options.get('ssl-subject-alt-names', '')
         self.options['ssl-verify-client'] = self.options['ssl_verify_client'] = \
             self.options.get('ssl-verify-client', 'off')
         self.options['ssl-client-certificate'] = self.options['ssl_client_certificate'] = \
@@ -137,97 +425,752 @@ class Recipe(object):
             self.options.get(
                 'ssl-client-certificate-url',
                 'https://github.com/ESGF/esgf-dist/raw/master/installer/certs/esgf-ca-bundle.crt')
+        self.options['ssl-client-certificate-sha256'] = self.options['ssl_client_certificate_sha256'] = \
+            self.options.get('ssl-client-certificate-sha256', '')
+        self.options['ssl-client-certificate-timeout'] = self.options['ssl_client_certificate_timeout'] = \
+            self.options.get('ssl-client-certificate-timeout', '30')
+        # tls handshake performance
+        self.options['ssl-session-cache'] = self.options['ssl_session_cache'] = \
+            self.options.get('ssl-session-cache', 'shared:SSL:10m')
+        self.options['ssl-session-timeout'] = self.options['ssl_session_timeout'] = \
+            self.options.get('ssl-session-timeout', '1h')
+        self.options['ssl-session-tickets'] = self.options['ssl_session_tickets'] = \
+            self.options.get('ssl-session-tickets', 'on')
+        self.options['ssl-session-ticket-key'] = self.options['ssl_session_ticket_key'] = \
+            self.options.get('ssl-session-ticket-key', '')
+        self.options['ssl-stapling'] = self.options['ssl_stapling'] = self.options.get('ssl-stapling', 'off')
+        self.options['ssl-stapling-verify'] = self.options['ssl_stapling_verify'] = \
+            self.options.get('ssl-stapling-verify', self.options['ssl-stapling'])
+        self.options['resolver'] = self.options.get('resolver', '')
+        self.options['ssl-buffer-size'] = self.options['ssl_buffer_size'] = self.options.get('ssl-buffer-size', '4k')
 
-        self.input = options.get('input')
+        # upstream pool
+        self.upstream_options(self.options, self.name)
+        self.options['proxy-keepalive'] = self.options['proxy_keepalive'] = _snippets.proxy_keepalive()
 
-        # make nginx dirs
-        make_dirs(self.options['etc-directory'], self.options['etc-user'], mode=0o755)
-        for dirname in ['client', 'fastcgi', 'proxy', 'scgi', 'uwsgi']:
-            make_dirs(os.path.join(self.options['etc-directory'], dirname), self.options['etc-user'], mode=0o755)
-        # var folder
-        make_dirs(self.options['var-prefix'], self.options['user'], mode=0o755)
-        make_dirs(os.path.join(self.options['var-prefix'], 'run'), self.options['user'], mode=0o755)
-        make_dirs(os.path.join(self.options['var-prefix'], 'tmp', 'nginx'), self.options['user'], mode=0o755)
-        # make www folder
-        make_dirs(os.path.join(self.options['var-prefix'], 'www'), self.options['user'], mode=0o755)
+        # proxy cache
+        self.options['proxy-cache-zones'] = self.options['proxy_cache_zones'] = \
+            self.options.get('proxy-cache-zones', '')
+        self.options['proxy-cache-key'] = self.options['proxy_cache_key'] = \
+            self.options.get('proxy-cache-key', '$scheme$request_method$host$request_uri')
+        self.options['proxy-cache-valid'] = self.options['proxy_cache_valid'] = \
+            self.options.get('proxy-cache-valid', '200 10m')
+        self.options['proxy-cache-lock'] = self.options['proxy_cache_lock'] = \
+            self.options.get('proxy-cache-lock', 'on')
+        self.options['proxy-cache-lock-timeout'] = self.options['proxy_cache_lock_timeout'] = \
+            self.options.get('proxy-cache-lock-timeout', '5s')
+        self.options['proxy-cache-use-stale'] = self.options['proxy_cache_use_stale'] = \
+            self.options.get('proxy-cache-use-stale', 'error timeout updating http_500 http_502 http_503 http_504')
+        self.options['proxy-cache-background-update'] = self.options['proxy_cache_background_update'] = \
+            self.options.get('proxy-cache-background-update', 'on')
+        self.options['proxy-cache-requests'] = self.options['proxy_cache_requests'] = \
+            self.options.get('proxy-cache-requests', 'GetCapabilities DescribeProcess')
+        self.options['proxy-cache-map'] = self.options['proxy_cache_map'] = \
+            _snippets.proxy_cache_map(self.options['proxy-cache-requests'])
+        self.cache_zones = []
+        self.proxy_cache_options(self.options)
+
+        # large output files: X-Accel-Redirect hand-off, aio threads and slice caching
+        self.options['outputs-root'] = self.options['outputs_root'] = self.options.get('outputs-root', '')
+        self.options['outputs-url'] = self.options['outputs_url'] = self.options.get('outputs-url', '/outputs')
+        self.options['outputs-internal-url'] = self.options['outputs_internal_url'] = \
+            self.options.get('outputs-internal-url', '/_outputs')
+        self.options['outputs-threads'] = self.options['outputs_threads'] = self.options.get('outputs-threads', '16')
+        self.options['outputs-directio'] = self.options['outputs_directio'] = \
+            self.options.get('outputs-directio', '4m')
+        self.options['outputs-upstream'] = self.options['outputs_upstream'] = self.options.get('outputs-upstream', '')
+        self.options['outputs-slice'] = self.options['outputs_slice'] = self.options.get('outputs-slice', '1m')
+        self.options['outputs-cache-size'] = self.options['outputs_cache_size'] = \
+            self.options.get('outputs-cache-size', '10g')
+        self.options['outputs-cache-valid'] = self.options['outputs_cache_valid'] = \
+            self.options.get('outputs-cache-valid', '7d')
+        self.options['outputs'] = ''
+        if self.options['outputs-root']:
+            slice_zone = ''
+            if self.options['outputs-upstream'] and self.options['outputs-slice']:
+                slice_zone = 'outputs'
+                add_zone(self.cache_zones, _snippets.cache_zones(
+                    'outputs 10m inactive=%s max_size=%s' % (
+                        self.options['outputs-cache-valid'], self.options['outputs-cache-size']))[0], 'proxy cache')
+            self.options['outputs'] = _snippets.outputs_locations(
+                self.options['outputs-root'], self.options['outputs-url'], self.options['outputs-internal-url'],
+                directio=self.options['outputs-directio'],
+                upstream=self.options['outputs-upstream'],
+                slice_size=self.options['outputs-slice'],
+                cache_zone=slice_zone,
+                cache_valid=self.options['outputs-cache-valid'])
+
+        # stub_status location and prometheus exporter
+        self.options['status'] = self.options.get('status', 'false')
+        self.options['status-listen'] = self.options['status_listen'] = \
+            self.options.get('status-listen', '127.0.0.1:8088')
+        self.options['status-path'] = self.options['status_path'] = self.options.get('status-path', '/nginx_status')
+        self.options['status-exporter'] = self.options['status_exporter'] = self.options.get('status-exporter', 'false')
+        self.options['status-exporter-listen'] = self.options['status_exporter_listen'] = \
+            self.options.get('status-exporter-listen', '127.0.0.1:9113')
+        self.options['status-url'] = self.options['status_url'] = status_url(
+            self.options['status-listen'], self.options['status-path'])
+        self.options['bin-directory'] = self.options['bin_directory'] = b_options['bin-directory']
+
+        # performance lint of the rendered configuration: off, warn or strict
+        self.options['lint'] = self.options.get('lint', 'warn')
+        if self.options['lint'] not in ('off', 'warn', 'strict'):
+            raise zc.buildout.UserError("Unknown lint mode: %s" % self.options['lint'])
+        self.options['lint-connections'] = self.options['lint_connections'] = \
+            self.options.get('lint-connections', '0')
+
+        # request rate and connection limits
+        self.options['limit-clients'] = self.options['limit_clients'] = self.options.get('limit-clients', '10000')
+        self.options['limit-req-status'] = self.options['limit_req_status'] = \
+            self.options.get('limit-req-status', '429')
+        self.options['limit-conn-status'] = self.options['limit_conn_status'] = \
+            self.options.get('limit-conn-status', '429')
+        self.limit_zones = []
+        self.limit_options(self.options)
+
+        # gzip and build-time precompression
+        self.options['gzip-comp-level'] = self.options['gzip_comp_level'] = self.options.get('gzip-comp-level', '5')
+        self.options['gzip-min-length'] = self.options['gzip_min_length'] = \
+            self.options.get('gzip-min-length', '256')
+        self.options['gzip-types'] = self.options['gzip_types'] = self.options.get(
+            'gzip-types',
+            'text/plain text/css text/xml text/javascript application/javascript application/json '
+            'application/xml application/rss+xml image/svg+xml')
+        self.options['gzip-vary'] = self.options['gzip_vary'] = self.options.get('gzip-vary', 'on')
+        self.options['precompress'] = self.options.get('precompress', 'false')
+        precompress = bool_option(self.options, 'precompress', False)
+        self.options['precompress-roots'] = self.options['precompress_roots'] = \
+            self.options.get('precompress-roots', os.path.join(self.options['var-prefix'], 'www'))
+        self.options['precompress-extensions'] = self.options['precompress_extensions'] = self.options.get(
+            'precompress-extensions', '.html .htm .css .js .mjs .json .xml .svg .txt .csv .map .wasm')
+        self.options['precompress-workers'] = self.options['precompress_workers'] = \
+            self.options.get('precompress-workers', '')
+        self.options['gzip-static'] = self.options['gzip_static'] = \
+            self.options.get('gzip-static', 'on' if precompress else 'off')
+        self.options['brotli-static'] = self.options['brotli_static'] = self.options.get('brotli-static', 'off')
+
+        # browser caching of static files
+        self.options['static-cache'] = self.options['static_cache'] = self.options.get('static-cache', 'false')
+        self.options['static-cache-expires'] = self.options['static_cache_expires'] = self.options.get(
+            'static-cache-expires', '\n'.join([
+                'text/html 5m',
+                'text/css 7d',
+                'application/javascript 7d',
+                'text/javascript 7d',
+                'image/ 30d',
+                'font/ 1y',
+                'application/font-woff 1y']))
+        self.options['static-cache-immutable'] = self.options['static_cache_immutable'] = self.options.get(
+            'static-cache-immutable',
+            r'\.[0-9a-f]{8,}\.(css|js|mjs|png|jpe?g|gif|svg|webp|avif|ico|woff2?|ttf|otf|eot|map)$')
+        self.options['static-cache-etag'] = self.options['static_cache_etag'] = \
+            self.options.get('static-cache-etag', 'on')
+        self.options['static-cache-map'] = self.options['static_cache_map'] = ''
+        self.options['static-cache-headers'] = self.options['static_cache_headers'] = ''
+        if bool_option(self.options, 'static-cache', False):
+            self.options['static-cache-map'] = self.options['static_cache_map'] = _snippets.expires_map(
+                self.options['static-cache-expires'], self.options['static-cache-immutable'])
+            self.options['static-cache-headers'] = self.options['static_cache_headers'] = _snippets.static_cache()
+        self.options['static-cache-fingerprint'] = self.options['static_cache_fingerprint'] = \
+            self.options.get('static-cache-fingerprint', 'false')
+        self.options['static-cache-roots'] = self.options['static_cache_roots'] = \
+            self.options.get('static-cache-roots', os.path.join(self.options['var-prefix'], 'www'))
+        self.options['static-cache-extensions'] = self.options['static_cache_extensions'] = self.options.get(
+            'static-cache-extensions', '.css .js .mjs .png .jpg .jpeg .gif .svg .webp .ico .woff .woff2 .ttf')
+        self.options['static-cache-assets'] = self.options['static_cache_assets'] = self.options.get(
+            'static-cache-assets', os.path.join(self.options['var-prefix'], 'www', 'assets.json'))
+        self.options['static-cache-keep-days'] = self.options['static_cache_keep_days'] = \
+            self.options.get('static-cache-keep-days', str(_assets.KEEP_DAYS))
+
+        # access logging
+        self.options['log-format'] = self.options['log_format'] = self.options.get('log-format', 'combined')
+        self.options['log-format-name'] = self.options['log_format_name'] = \
+            self.options.get('log-format-name', 'timed')
+        if self.options['log-format'] == 'combined':
+            self.options['log-format-directive'] = self.options['log_format_directive'] = ''
+            log_format_name = 'combined'
+        else:
+            self.options['log-format-directive'] = self.options['log_format_directive'] = _snippets.log_format(
+                self.options['log-format-name'], self.options['log-format'])
+            log_format_name = self.options['log-format-name']
+        self.options['access-log-buffer'] = self.options['access_log_buffer'] = \
+            self.options.get('access-log-buffer', '')
+        self.options['access-log-flush'] = self.options['access_log_flush'] = self.options.get('access-log-flush', '')
+        self.options['access-log-gzip'] = self.options['access_log_gzip'] = self.options.get('access-log-gzip', '')
+        self.options['access-log-sample'] = self.options['access_log_sample'] = \
+            self.options.get('access-log-sample', '')
+        self.options['open-log-file-cache'] = self.options['open_log_file_cache'] = \
+            self.options.get('open-log-file-cache', '')
+        self.options['log-rotate-keep'] = self.options['log_rotate_keep'] = self.options.get('log-rotate-keep', '7')
+        access_log_path = os.path.join(self.options['log-directory'], 'access.log')
+        self.options['access-log'] = self.options['access_log'] = _snippets.access_log(
+            access_log_path, log_format_name,
+            buffer=self.options['access-log-buffer'],
+            flush=self.options['access-log-flush'],
+            gzip=self.options['access-log-gzip'])
+        self.options['access-log-sampled'] = self.options['access_log_sampled'] = _snippets.access_log(
+            access_log_path, log_format_name,
+            buffer=self.options['access-log-buffer'],
+            flush=self.options['access-log-flush'],
+            gzip=self.options['access-log-gzip'],
+            condition='$access_log_sampled' if self.options['access-log-sample'] else '')
+
+        # site configurations: input templates (paths or globs, one per line) and site sections
+        self.inputs = options.get('input', '').split()
+        self.options['sites'] = self.options.get('sites', '')
+        self.options['site-workers'] = self.options['site_workers'] = self.options.get('site-workers', '8')
+        self.sites = []
+        for section in self.options['sites'].split():
+            overrides = dict(self.buildout[section])
+            if 'input' not in overrides:
+                raise zc.buildout.UserError("Site section [%s] has no input template." % section)
+            name = overrides.get('name', section)
+            self.sites.append((name, self.site_options(name, overrides)))
+
+        # zones of the part and its sites are declared in nginx.conf
+        self.options['limit-zones'] = self.options['limit_zones'] = '\n'.join(
+            _snippets.limit_zone(name, zone_key, params, kind) for name, kind, zone_key, params in self.limit_zones)
+        self.options['proxy-cache-paths'] = self.options['proxy_cache_paths'] = '\n'.join(
+            _snippets.proxy_cache_path(os.path.join(self.options['cache-directory'], name), name, size, params)
+            for name, size, params in self.cache_zones)
+
+    def listen_options(self, options):
+        """Sets the generated listeners ``http-listen`` and ``https-listen`` unless they are given."""
+        listen_params = ' reuseport' if bool_option(options, 'reuseport', False) else ''
+        options['http-listen'] = options['http_listen'] = \
+            options.get('http-listen', options['http-port'] + listen_params)
+        if bool_option(options, 'http2', False):
+            listen_params = ' http2' + listen_params
+        options['https-listen'] = options['https_listen'] = \
+            options.get('https-listen', options['https-port'] + ' ssl' + listen_params)
+
+    def upstream_options(self, options, name):
+        """Sets the ``upstream-*`` options and the ``upstream`` block, named ``name`` by default."""
+        options['upstream-name'] = options['upstream_name'] = options.get('upstream-name', name)
+        options['upstream-servers'] = options['upstream_servers'] = options.get('upstream-servers', '')
+        options['upstream-balance'] = options['upstream_balance'] = options.get('upstream-balance', 'round_robin')
+        options['upstream-keepalive'] = options['upstream_keepalive'] = options.get('upstream-keepalive', '32')
+        options['upstream-keepalive-requests'] = options['upstream_keepalive_requests'] = \
+            options.get('upstream-keepalive-requests', '1000')
+        options['upstream-keepalive-timeout'] = options['upstream_keepalive_timeout'] = \
+            options.get('upstream-keepalive-timeout', '60s')
+        options['upstream-max-fails'] = options['upstream_max_fails'] = options.get('upstream-max-fails', '1')
+        options['upstream-fail-timeout'] = options['upstream_fail_timeout'] = \
+            options.get('upstream-fail-timeout', '10s')
+        options['upstream-zone'] = options['upstream_zone'] = options.get('upstream-zone', '64k')
+        servers = _snippets.split_servers(options['upstream-servers'])
+        if servers:
+            options['upstream'] = _snippets.upstream_block(
+                options['upstream-name'], servers,
+                balance=options['upstream-balance'],
+                keepalive=options['upstream-keepalive'],
+                keepalive_requests=options['upstream-keepalive-requests'],
+                keepalive_timeout=options['upstream-keepalive-timeout'],
+                max_fails=options['upstream-max-fails'],
+                fail_timeout=options['upstream-fail-timeout'],
+                zone=options['upstream-zone'])
+        else:
+            options['upstream'] = ''
+
+    def proxy_cache_options(self, options):
+        """Sets the ``proxy_cache`` snippets of the ``proxy-cache-zones`` and adds the zones to the part."""
+        zones = _snippets.cache_zones(options['proxy-cache-zones'])
+        options['proxy-cache'] = options['proxy_cache'] = ''
+        # the map of the part in nginx.conf decides which requests are cached
+        skip = _snippets.PROXY_CACHE_SKIP if self.options['proxy-cache-map'] else ''
+        for name, size, params in reversed(zones):
+            snippet = _snippets.proxy_cache(name, options['proxy-cache-valid'], skip)
+            options['proxy-cache-zone-' + name] = options['proxy_cache_zone_' + name] = snippet
+            options['proxy-cache'] = options['proxy_cache'] = snippet
+        for zone in zones:
+            add_zone(self.cache_zones, zone, 'proxy cache')
+
+    def limit_options(self, options):
+        """Sets the ``limit_req``/``limit_conn`` snippets of the limit zones and adds the zones to the part."""
+        for kind in ('req', 'conn'):
+            key = 'limit-%s-zones' % kind
+            options[key] = options[key.replace('-', '_')] = options.get(key, '')
+            options['limit-' + kind] = options['limit_' + kind] = ''
+            zones = _snippets.limit_zones(options[key], kind, options['limit-clients'])
+            for name, zone_key, params in reversed(zones):
+                snippet = _snippets.limit(name, params, kind)
+                options['limit-%s-zone-%s' % (kind, name)] = options['limit_%s_zone_%s' % (kind, name)] = snippet
+                options['limit-' + kind] = options['limit_' + kind] = snippet
+            for name, zone_key, params in zones:
+                add_zone(self.limit_zones, (name, kind, zone_key, params), 'limit_%s' % kind)
+
+    def site_options(self, name, overrides):
+        """
+        Returns the options of the site ``name``: the part options with the ``overrides`` of its
+        section in both key forms and the snippets derived from them.
+
+        Listeners follow the ports of the site and the upstream is named after the site,
+        unless the section sets them.
+        """
+        options = dict(self.options)
+        overrides = dict((key.replace('_', '-'), value) for key, value in overrides.items())
+        for key, value in overrides.items():
+            options[key] = options[key.replace('-', '_')] = value
+        for key, source in (('http-listen', 'http-port'), ('https-listen', 'https-port'),
+                            ('http-listen', 'reuseport'), ('https-listen', 'reuseport'), ('https-listen', 'http2')):
+            if source in overrides and key not in overrides:
+                options.pop(key, None)
+        if 'upstream-name' not in overrides:
+            options.pop('upstream-name')
+        self.listen_options(options)
+        self.upstream_options(options, name)
+        self.proxy_cache_options(options)
+        self.limit_options(options)
+        return options
 
     def install(self, update=False):
+        self.manifest = Manifest(os.path.join(self.part_directory, 'manifest.json'))
+        self.timings = []
         installed = []
         if not update:
-            installed += list(self.deployment.install())
-        installed += list(self.conda.install(update))
-        installed += list(self.install_cert(update))
-        installed += list(self.install_ca_bundle(update))
-        installed += list(self.install_config(update))
-        installed += list(self.install_supervisor(update))
-        installed += list(self.install_sites(update))
+            installed += self.timed('deployment', self.deployment.install)
+        installed += self.timed('dirs', self.install_dirs, update)
+        installed += self.timed('conda', self.install_conda, update)
+        installed += self.timed('cert', self.install_cert, update)
+        installed += self.timed('ca-bundle', self.install_ca_bundle, update)
+        installed += self.timed('ticket-key', self.install_ticket_key, update)
+        installed += self.timed('config', self.install_config, update)
+        installed += self.timed('assets', self.install_assets, update)
+        installed += self.timed('precompress', self.install_precompress, update)
+        installed += self.timed('logrotate', self.install_logrotate, update)
+        installed += self.timed('supervisor', self.install_supervisor, update)
+        installed += self.timed('status', self.install_status, update)
+        installed += self.timed('sites', self.install_sites, update)
+        installed += self.timed('lint', self.install_lint, update)
+        installed += self.timed('reload', self.install_reload, update)
+        self.manifest.save()
+        self.save_timings(update)
+        installed.append(self.part_directory)
         return installed
 
-    def install_cert(self, update):
-        certfile = os.path.join(self.options['etc-directory'], 'cert.pem')
-        if update:
-            # Skip cert generation on update mode
-            return []
-        elif os.path.isfile(certfile):
-            # Skip cert generation if file already exists.
-            return []
-        elif generate_cert(
-                out=certfile,
-                org=self.options.get('organization'),
-                org_unit=self.options.get('organization-unit'),
-                hostname=self.options.get('hostname'),
-                key_length=int(self.options.get('ssl-key-length'))):
+    def timed(self, phase, method, *args):
+        """Calls an install phase, logs and records its duration."""
+        start = time.time()
+        result = list(method(*args))
+        elapsed = time.time() - start
+        self.timings.append((phase, elapsed))
+        self.logger.debug("%s took %.3fs", phase, elapsed)
+        return result
+
+    def save_timings(self, update):
+        """Writes the phase durations of this run to ``install-timings.json`` in the part directory."""
+        total = sum(elapsed for phase, elapsed in self.timings)
+        slowest = max(self.timings, key=lambda timing: timing[1])
+        self.logger.info(
+            "%s in %.3fs, slowest phase %s (%.3fs)", 'Updated' if update else 'Installed', total,
+            slowest[0], slowest[1])
+        summary = {
+            'part': self.name,
+            'update': update,
+            'finished': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'total': round(total, 6),
+            'phases': [{'phase': phase, 'seconds': round(elapsed, 6)} for phase, elapsed in self.timings],
+        }
+        _fetch.write_if_changed(
+            os.path.join(self.part_directory, 'install-timings.json'),
+            json.dumps(summary, indent=2, sort_keys=True).encode('utf-8'))
+
+    def install_dirs(self, update):
+        """Creates the nginx directories in one pass."""
+        etc_user = self.options['etc-user']
+        user = self.options['user']
+        etc_directory = self.options['etc-directory']
+        var_prefix = self.options['var-prefix']
+        dirs = [(etc_directory, etc_user, 0o755)]
+        # var folder
+        dirs.append((var_prefix, user, 0o755))
+        dirs.append((os.path.join(var_prefix, 'run'), user, 0o755))
+        dirs.append((os.path.join(var_prefix, 'tmp'), user, 0o755))
+        # temp files of request bodies and proxied responses, see supervisor_command for a tmpfs
+        dirs.append((self.options['temp-directory'], user, 0o755))
+        for dirname in TEMP_PATHS:
+            dirs.append((os.path.join(self.options['temp-directory'], dirname), user, 0o700))
+        # www folder
+        dirs.append((os.path.join(var_prefix, 'www'), user, 0o755))
+        # proxy cache zones
+        for name, size, params in self.cache_zones:
+            dirs.append((os.path.join(self.options['cache-directory'], name), user, 0o700))
+        make_tree(dirs)
+        return []
+
+    def install_conda(self, update):
+        """
+        Installs the conda packages unless the environment has them already.
+
+        The requested specs and channels are compared with the ``conda-meta`` records
+        of the environment, the result is kept in the manifest.
+        """
+        prefix = self.options['conda-prefix']
+        state = fingerprint(_conda.state(prefix, self.conda.pkgs, self.conda.channels))
+        if self.manifest.get('conda') == state:
             return []
+        missing = _conda.unsatisfied(prefix, self.conda.pkgs, self.conda.channels)
+        installed = []
+        if missing:
+            self.logger.info("Installing conda packages missing in %s: %s", prefix, ' '.join(missing))
+            installed = list(self.conda.install(update))
+            state = fingerprint(_conda.state(prefix, self.conda.pkgs, self.conda.channels))
+            missing = _conda.unsatisfied(prefix, self.conda.pkgs, self.conda.channels)
+        if missing:
+            self.manifest.remove('conda')
         else:
-            return []
+            self.manifest.set('conda', state)
+        return installed
+
+    def install_cert(self, update):
+        certfile = os.path.join(self.options['etc-directory'], 'cert.pem')
+        key = None
+        if os.path.isfile(certfile):
+            cert, key = read_cert(certfile)
+            renew = datetime.timedelta(days=int(self.options['ssl-cert-renew-days']))
+            if cert is None or cert.issuer != cert.subject:
+                # Skip certificates which are not self signed.
+                return []
+            if key is not None and key_type_of(key) != self.options['ssl-key-type']:
+                self.logger.info("Reissuing certificate %s with a new %s key", certfile, self.options['ssl-key-type'])
+                key = None
+            elif not cert_matches(cert, self.options.get('hostname'), self.options['ssl-subject-alt-names'].split()):
+                self.logger.info("Reissuing certificate %s for changed host names", certfile)
+            elif cert_expires(cert) - renew > datetime.datetime.utcnow():
+                # Skip cert generation if the certificate is not expiring.
+                return []
+            else:
+                self.logger.info("Reissuing expiring certificate %s", certfile)
+        generate_cert(
+            out=certfile,
+            org=self.options.get('organization'),
+            org_unit=self.options.get('organization-unit'),
+            hostname=self.options.get('hostname'),
+            key_length=int(self.options.get('ssl-key-length')),
+            key_type=self.options['ssl-key-type'],
+            days=int(self.options['ssl-cert-days']),
+            alt_names=self.options['ssl-subject-alt-names'].split(),
+            key=key)
+        return []
 
     def install_ca_bundle(self, update):
         if self.options['ssl-verify-client'] in ['on', 'optional'] and \
                 self.options.get('ssl-client-certificate-url', ''):
+            url = self.options['ssl-client-certificate-url']
+            cache_dir = self.buildout['buildout'].get('download-cache') or \
+                os.path.join(self.part_directory, 'downloads')
+            cache_file = os.path.join(
+                cache_dir, 'nginx', fingerprint(url)[:16] + '-' + os.path.basename(url))
+            data = _fetch.fetch(
+                url, cache_file,
+                timeout=float(self.options['ssl-client-certificate-timeout']),
+                sha256=self.options['ssl-client-certificate-sha256'],
+                offline=bool_option(
+                    self.options, 'offline', bool_option(self.buildout['buildout'], 'offline', False)))
             ca_bundle_file = os.path.join(self.options['etc-directory'], self.options['ssl-client-certificate'])
-            urlretrieve(
-                self.options['ssl-client-certificate-url'],
-                ca_bundle_file)
+            if _fetch.write_if_changed(ca_bundle_file, data, mode=0o644):
+                self.logger.info("Updated %s", ca_bundle_file)
+        return []
+
+    def install_ticket_key(self, update):
+        """
+        generate the shared TLS session ticket key if it does not exist yet
+        """
+        if not self.options['ssl-session-ticket-key']:
+            return []
+        keyfile = os.path.join(self.options['etc-directory'], self.options['ssl-session-ticket-key'])
+        if not os.path.isfile(keyfile):
+            fd = os.open(keyfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(os.urandom(80))
         return []
 
     def install_config(self, update):
         """
         install nginx main config file
         """
-        text = templ_config.render(**self.options)
-        config = Configuration(self.buildout, 'nginx.conf', {
-            'deployment': self.deployment_name,
-            'text': text})
+        config = self.render_file(templ_config_file, 'nginx.conf')
         # copy additional files
+        mime_types = os.path.join(os.path.dirname(__file__), "mime.types")
         try:
-            copy2(os.path.join(os.path.dirname(__file__), "mime.types"), self.options['etc-directory'])
+            if file_state(mime_types) != file_state(os.path.join(self.options['etc-directory'], 'mime.types')):
+                copy2(mime_types, self.options['etc-directory'])
         except Exception:
             pass
-        return [config.install()]
+        return [config]
+
+    def install_assets(self, update):
+        """
+        link static assets to content hashed names and write the asset manifest for the app
+        """
+        if not bool_option(self.options, 'static-cache-fingerprint', False):
+            return []
+        manifest = Manifest(os.path.join(self.part_directory, 'assets.json'))
+        _assets.fingerprint_assets(
+            roots=self.options['static-cache-roots'].split(),
+            extensions=self.options['static-cache-extensions'].split(),
+            manifest=manifest,
+            assets_file=self.options['static-cache-assets'],
+            immutable=self.options['static-cache-immutable'],
+            keep_days=float(self.options['static-cache-keep-days']))
+        manifest.save()
+        return []
+
+    def install_precompress(self, update):
+        """
+        write gzip (and brotli) compressed siblings of static files for gzip_static
+        """
+        if not bool_option(self.options, 'precompress', False):
+            return []
+        manifest = Manifest(os.path.join(self.part_directory, 'precompress.json'))
+        _precompress.precompress(
+            roots=self.options['precompress-roots'].split(),
+            extensions=self.options['precompress-extensions'].split(),
+            manifest=manifest,
+            min_size=int(self.options['gzip-min-length']),
+            workers=int(self.options['precompress-workers'] or 0) or None)
+        manifest.save()
+        return []
+
+    def install_logrotate(self, update):
+        """
+        install script to rotate the logs without restarting nginx
+        """
+        script = self.render_file(templ_logrotate_file, 'nginx-rotate-logs.sh')
+        os.chmod(script, 0o755)
+        return [script]
+
+    def supervisor_command(self):
+        """
+        Returns the command of the nginx program.
+
+        nginx creates missing temp directories on start but not their parent, which is
+        gone from a tmpfs after a reboot. With ``temp-tmpfs`` the parent is created first.
+        """
+        command = templ_cmd.render(**self.options)
+        if bool_option(self.options, 'temp-tmpfs', False):
+            command = templ_tmpfs_cmd.render(command=command, **self.options)
+        return command
 
     def install_supervisor(self, update):
-        # for nginx only set chmod_user in supervisor!
-        script = supervisor.Recipe(
+        installed = []
+        command = self.supervisor_command()
+        # config changes are applied by install_reload, no need to touch the program on update
+        if not update or self.manifest.get('supervisor') != command:
+            self.manifest.set('supervisor', command)
+            # for nginx only set chmod_user in supervisor!
+            script = supervisor.Recipe(
+                self.buildout,
+                self.name + '-nginx',
+                {'prefix': self.options['prefix'],
+                 'user': self.options['user'],
+                 'etc-user': self.options['etc-user'],
+                 'skip-user': True,
+                 'program': 'nginx',
+                 'command': command,
+                 'directory': '%s/sbin' % (self.options['conda-prefix']),
+                 })
+            installed += list(script.install(update))
+        if bool_option(self.options, 'status-exporter', False):
+            installed += self.install_exporter(update)
+        return installed
+
+    def install_exporter(self, update):
+        """Installs the ``nginx-exporter`` script and its supervisor program."""
+        command = templ_exporter_cmd.render(**self.options)
+        script = os.path.join(self.options['bin-directory'], 'nginx-exporter')
+        if update and self.manifest.get('supervisor-exporter') == command and os.path.exists(script):
+            return []
+        self.manifest.set('supervisor-exporter', command)
+        installed = list(zc.recipe.egg.Egg(self.buildout, self.name + '-nginx-exporter', {
+            'eggs': 'birdhousebuilder.recipe.nginx',
+            'scripts': 'nginx-exporter'}).install())
+        program = supervisor.Recipe(
             self.buildout,
-            self.name + '-nginx',
+            self.name + '-nginx-exporter',
             {'prefix': self.options['prefix'],
              'user': self.options['user'],
              'etc-user': self.options['etc-user'],
-             'skip-user': True,
-             'program': 'nginx',
-             'command': templ_cmd.render(**self.options),
-             'directory': '%s/sbin' % (self.options['conda-prefix']),
+             'program': 'nginx-exporter',
+             'command': command,
+             'directory': self.options['bin-directory'],
+             'autorestart': 'true',
              })
-        return script.install(update)
+        return installed + list(program.install(update))
+
+    def install_status(self, update):
+        """Installs ``conf.d/nginx-status.conf`` with the stub_status location or removes it."""
+        directory = os.path.join(self.options['etc-directory'], 'conf.d')
+        if bool_option(self.options, 'status', False):
+            return [self.render_file(templ_status_file, 'nginx-status.conf', directory=directory)]
+        location = os.path.join(directory, 'nginx-status.conf')
+        if self.manifest.get(location):
+            if os.path.exists(location):
+                os.remove(location)
+            self.manifest.remove(location)
+        return []
+
+    def install_lint(self, update):
+        """
+        Checks the rendered configuration for performance anti-patterns.
+
+        Findings are logged, with ``lint = strict`` they fail the install. An unchanged
+        configuration is not checked again.
+        """
+        mode = self.options['lint']
+        digest = _control.config_digest(self.options['etc-directory'])
+        if mode == 'off' or self.manifest.get('lint') == digest:
+            return []
+        conf_file = os.path.join(self.options['etc-directory'], 'nginx.conf')
+        try:
+            findings = lint.lint_file(conf_file, int(self.options['lint-connections']))
+        except (IOError, ValueError) as err:
+            findings = ["Could not parse %s: %s" % (conf_file, err)]
+        for finding in findings:
+            self.logger.warning("%s", finding)
+        if findings and mode == 'strict':
+            raise zc.buildout.UserError("nginx configuration lint failed with %d findings" % len(findings))
+        self.manifest.set('lint', digest)
+        return []
+
+    def install_reload(self, update):
+        """
+        validate changed configuration and let a running nginx reload it gracefully
+        """
+        nginx_bin = os.path.join(self.options['conda-prefix'], 'sbin', 'nginx')
+        conf_file = os.path.join(self.options['etc-directory'], 'nginx.conf')
+        pid_file = os.path.join(self.options['run-directory'], 'nginx.pid')
+        state = self.manifest.get('nginx') or {}
+        digest = _control.config_digest(self.options['etc-directory'])
+        version = _control.nginx_version(nginx_bin)
+        if digest == state.get('digest') and version == state.get('version'):
+            self.reload_status = 'unchanged'
+        else:
+            self.reload_status = 'changed'
+            pid = _control.read_pid(pid_file)
+            if version is None:
+                self.logger.warning("Skipping configuration test, %s not found.", nginx_bin)
+            else:
+                success, output = _control.test_config(nginx_bin, self.prefix, conf_file)
+                if not success and pid:
+                    raise zc.buildout.UserError("nginx configuration test failed:\n%s" % output)
+                elif not success:
+                    self.logger.warning("nginx configuration test failed:\n%s", output)
+                elif pid and bool_option(self.options, 'graceful-reload', True):
+                    if state.get('version') and version != state['version'] and \
+                            bool_option(self.options, 'binary-upgrade', False):
+                        self.upgrade_binary(pid, pid_file)
+                    else:
+                        _control.reload(pid)
+                        self.reload_status = 'reloaded'
+        self.manifest.set('nginx', {'digest': digest, 'version': version})
+        self.logger.info("nginx configuration %s.", self.reload_status)
+        return []
+
+    def upgrade_binary(self, pid, pid_file):
+        """
+        Replaces the running nginx with the new binary.
+
+        supervisord would restart the program when the old master quits and the new master
+        keeps running, so a supervised nginx is restarted by ``supervisorctl`` instead.
+        """
+        if not _control.supervised(pid):
+            _control.binary_upgrade(pid_file)
+            self.reload_status = 'upgraded'
+            return
+        self.logger.warning("nginx runs under supervisord, restarting it instead of a binary upgrade.")
+        success, output = _control.restart(os.path.join(self.options['bin-directory'], 'supervisorctl'))
+        if not success:
+            raise zc.buildout.UserError("Could not restart nginx with supervisorctl:\n%s" % output)
+        self.reload_status = 'restarted'
+
+    def site_files(self):
+        """
+        Returns the site configurations as (conf.d filename, template, options) tuples.
+
+        A single ``input`` template is installed as ``<name>.conf``. With several inputs or
+        globs each template is installed under its own basename.
+        """
+        files = []
+        if len(self.inputs) == 1 and not glob.has_magic(self.inputs[0]):
+            files.append((self.name + '.conf', self.inputs[0], self.options))
+        else:
+            for pattern in self.inputs:
+                templates = sorted(glob.glob(pattern))
+                if not templates:
+                    raise zc.buildout.UserError("No site templates match %s" % pattern)
+                files.extend((site_filename(template), template, self.options) for template in templates)
+        for name, site_options in self.sites:
+            files.append((site_filename(name), site_options['input'], site_options))
+        seen = set()
+        for filename, template, options in files:
+            if filename in seen:
+                raise zc.buildout.UserError("Several sites are installed as conf.d/%s" % filename)
+            seen.add(filename)
+        return files
 
     def install_sites(self, update):
-        templ_sites = Template(filename=self.input)
-        text = templ_sites.render(**self.options)
-        config = Configuration(self.buildout, self.name + '.conf', {
-            'deployment': self.deployment_name,
-            'directory': os.path.join(self.options['etc-directory'], 'conf.d'),
-            'text': text})
-        return [config.install()]
+        """
+        Renders the site templates concurrently to ``conf.d``.
+
+        Site files of an earlier run which are no longer declared are removed.
+        Template errors of all sites are reported together.
+        """
+        directory = os.path.join(self.options['etc-directory'], 'conf.d')
+        files = self.site_files()
+        installed = []
+        errors = []
+
+        def render(site):
+            filename, template, options = site
+            return self.render_file(template, filename, directory=directory, options=options)
+
+        workers = max(1, min(len(files), int(self.options['site-workers'])))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(site, executor.submit(render, site)) for site in files]
+            for (filename, template, options), future in futures:
+                try:
+                    installed.append(future.result())
+                except Exception as err:
+                    errors.append("%s (%s): %s" % (filename, template, err))
+        declared = [os.path.join(directory, filename) for filename, template, options in files]
+        for location in self.manifest.get('sites', []):
+            if location not in declared:
+                self.logger.info("Removing stale site configuration %s", location)
+                if os.path.exists(location):
+                    os.remove(location)
+                self.manifest.remove(location)
+        self.manifest.set('sites', declared)
+        if errors:
+            raise zc.buildout.UserError(
+                "Could not render %d site configuration(s):\n%s" % (len(errors), '\n'.join(errors)))
+        return installed
+
+    def render_file(self, template_file, filename, directory=None, options=None):
+        """
+        render ``template_file`` with the part options and install it as ``filename``.
+
+        Rendering is skipped when template and options are unchanged and the installed
+        file was not modified since. The file is only rewritten when its content changed.
+        """
+        directory = directory or self.options['etc-directory']
+        options = dict(options or self.options)
+        location = os.path.join(directory, filename)
+        inputs = fingerprint(
+            os.path.abspath(template_file), os.stat(template_file).st_mtime, options)
+        if self.manifest.is_current(location, inputs):
+            return location
+        text = load_template(template_file, self.template_cache).render(**options)
+        digest = fingerprint(text)
+        entry = self.manifest.get(location) or {}
+        if entry.get('digest') != digest or entry.get('state') != file_state(location):
+            config = Configuration(self.buildout, filename, {
+                'deployment': self.deployment_name,
+                'directory': directory,
+                'text': text})
+            location = config.install()
+        self.manifest.set(location, {'inputs': inputs, 'digest': digest, 'state': file_state(location)})
+        return location
 
     def update(self):
         return self.install(update=True)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""Content hashed copies of static assets for far-future caching."""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+from birdhousebuilder.recipe.nginx._fetch import write_if_changed
+from birdhousebuilder.recipe.nginx._precompress import find_files
+from birdhousebuilder.recipe.nginx._precompress import SUFFIXES
+from birdhousebuilder.recipe.nginx._render import file_state
+
+LOGGER = logging.getLogger('nginx-assets')
+
+HASH_LENGTH = 12
+KEEP_DAYS = 7
+
+
+def fingerprinted_name(path, digest):
+    """Returns ``dir/name.<hash>.ext`` for ``dir/name.ext``."""
+    base, ext = os.path.splitext(path)
+    return '%s.%s%s' % (base, digest[:HASH_LENGTH], ext)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy(source, target):
+    # a hard link would change with the source when it is edited in place
+    tmp = target + '.tmp'
+    shutil.copy2(source, tmp)
+    os.rename(tmp, target)
+
+
+def _remove(path):
+    for name in [path] + [path + suffix for suffix in SUFFIXES]:
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def _retire(entry, target, now, keep):
+    """
+    Returns the previous copies of ``entry`` when its copy is replaced by ``target``.
+
+    Copies retired ``keep`` or more seconds ago are removed.
+    """
+    previous = list(entry.get('previous', []))
+    if entry.get('target') and entry['target'] != target:
+        previous.append([entry['target'], now])
+    kept = []
+    for path, retired in previous:
+        if path == target:
+            continue
+        elif now - retired < keep:
+            kept.append([path, retired])
+        else:
+            _remove(path)
+    return kept
+
+
+def fingerprint_assets(roots, extensions, manifest, assets_file, immutable=None, keep_days=KEEP_DAYS):
+    """
+    Copies each asset below ``roots`` to a name with the hash of its content.
+
+    Files matching the ``immutable`` regex are fingerprinted already and skipped.
+    ``manifest`` records the state and fingerprinted copy of each asset, unchanged
+    assets are not hashed again. Copies of changed or removed assets are kept for
+    ``keep_days``, so cached pages referring to them still work, and deleted after.
+    ``assets_file`` gets a json mapping of asset paths, relative to their root, to
+    the fingerprinted paths for the application. Returns that mapping.
+    """
+    immutable = re.compile(immutable) if immutable else None
+    now, keep = time.time(), keep_days * 86400
+    targets = set()
+    for entry in manifest.entries.values():
+        targets.add(entry['target'])
+        targets.update(target for target, _ in entry.get('previous', []))
+    assets = {}
+    seen = set()
+    for root in roots:
+        for path in find_files([root], extensions):
+            if path in targets or (immutable is not None and immutable.search(path)):
+                continue
+            seen.add(path)
+            state = file_state(path)
+            entry = manifest.get(path) or {}
+            if entry.get('state') == state and os.path.exists(entry['target']):
+                target = entry['target']
+            else:
+                target = fingerprinted_name(path, file_digest(path))
+                _copy(path, target)
+            manifest.set(path, {'state': state, 'target': target, 'previous': _retire(entry, target, now, keep)})
+            assets[os.path.relpath(path, root)] = os.path.relpath(target, root)
+    for path in set(manifest.entries) - seen:
+        previous = _retire(manifest.get(path), None, now, keep)
+        if previous:
+            manifest.set(path, {'state': None, 'target': None, 'previous': previous})
+        else:
+            manifest.remove(path)
+    if write_if_changed(assets_file, json.dumps(assets, indent=2, sort_keys=True).encode('utf-8'), mode=0o644):
+        LOGGER.info("Wrote %d fingerprinted assets to %s", len(assets), assets_file)
+    return assets
@@ -7,7 +7,14 @@ PY2 = sys.version_info[0] == 2
 if PY2:
     LOGGER.debug('Python 2.x')
     from urllib import urlretrieve
+    from urllib import unquote
+    from urllib2 import urlopen, Request
+    from urllib2 import HTTPError, URLError
+    from urlparse import urlparse
 
 else:
     LOGGER.debug('Python 3.x')
     from urllib.request import urlretrieve
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import urlparse, unquote
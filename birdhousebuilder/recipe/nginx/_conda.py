@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Check of the conda environment against the requested packages without running conda."""
+
+import os
+import re
+import json
+import glob
+import fnmatch
+
+SPEC_PATTERN = re.compile(r'^([A-Za-z0-9_.\-]+)(?:(==|=)([^=\s]+)(?:=(\S+))?)?$')
+PLATFORM_SUBDIRS = ('noarch', 'linux-64', 'linux-32', 'linux-aarch64', 'linux-ppc64le',
+                    'osx-64', 'osx-arm64', 'win-64', 'win-32')
+DEFAULTS_HOSTS = ('repo.anaconda.com', 'repo.continuum.io')
+
+
+def parse_spec(spec):
+    """
+    Splits a package spec ``name[=version[=build]]`` or ``name==version``.
+
+    Returns a tuple (name, operator, version, build) or None for specs which can only
+    be resolved by conda (version ranges, alternatives).
+    """
+    match = SPEC_PATTERN.match(spec.strip())
+    if match is None:
+        return None
+    return match.groups()
+
+
+def pin(pkgs, name, version='', build=''):
+    """Replaces the spec of package ``name`` in the ``pkgs`` list by ``name=version[=build]``."""
+    if not version and not build:
+        return pkgs
+    spec = '%s=%s' % (name, version or '*')
+    if build:
+        spec += '=' + build
+    pinned = [spec if (parse_spec(pkg) or [None])[0] == name else pkg for pkg in pkgs]
+    if spec not in pinned:
+        pinned.append(spec)
+    return pinned
+
+
+def installed(prefix):
+    """
+    Returns the installed packages of the environment at ``prefix``.
+
+    The names of the ``conda-meta`` records are ``<name>-<version>-<build>.json``,
+    so the result maps package names to (version, build, record path) without
+    reading the records.
+    """
+    packages = {}
+    for path in glob.glob(os.path.join(prefix, 'conda-meta', '*.json')):
+        parts = os.path.basename(path)[:-len('.json')].rsplit('-', 2)
+        if len(parts) == 3:
+            packages[parts[0]] = (parts[1], parts[2], path)
+    return packages
+
+
+def channel_name(record):
+    """Returns the channel name of a ``conda-meta`` record, ``defaults`` for the Anaconda repository."""
+    url = record.get('channel') or ''
+    if record.get('schannel'):
+        name = record['schannel']
+    elif '://' in url:
+        if any(host in url for host in DEFAULTS_HOSTS):
+            return 'defaults'
+        segments = url.rstrip('/').split('/')
+        if segments[-1] in PLATFORM_SUBDIRS:
+            segments.pop()
+        name = segments[-1]
+    else:
+        name = url.rstrip('/')
+    if name.startswith('pkgs/'):
+        return 'defaults'
+    return name
+
+
+def version_matches(version, operator, wanted):
+    if not wanted:
+        return True
+    if operator == '==':
+        return version == wanted
+    return fnmatch.fnmatch(version, wanted) or fnmatch.fnmatch(version, wanted + '.*')
+
+
+def unsatisfied(prefix, specs, channels):
+    """
+    Returns the specs which are not installed in ``prefix`` from one of ``channels``.
+
+    Specs which can only be resolved by conda are always returned.
+    """
+    packages = installed(prefix)
+    missing = []
+    for spec in specs:
+        parsed = parse_spec(spec)
+        if parsed is None or parsed[0] not in packages:
+            missing.append(spec)
+            continue
+        name, operator, wanted_version, wanted_build = parsed
+        version, build, path = packages[name]
+        if not version_matches(version, operator, wanted_version) or \
+                (wanted_build and not fnmatch.fnmatch(build, wanted_build)):
+            missing.append(spec)
+            continue
+        if channels:
+            try:
+                with open(path) as fp:
+                    record = json.load(fp)
+            except (IOError, ValueError):
+                missing.append(spec)
+                continue
+            url = record.get('channel') or ''
+            if channel_name(record) not in channels and not any('/' in c and c.rstrip('/') in url for c in channels):
+                missing.append(spec)
+    return missing
+
+
+def state(prefix, specs, channels):
+    """Returns the requested specs and channels with the installed builds of these packages."""
+    packages = installed(prefix)
+    builds = {}
+    for spec in specs:
+        parsed = parse_spec(spec)
+        if parsed is not None and parsed[0] in packages:
+            builds[parsed[0]] = list(packages[parsed[0]][:2])
+    return {'prefix': prefix, 'specs': list(specs), 'channels': list(channels), 'builds': builds}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Minimal parser for rendered nginx configuration files."""
+
+import os
+import glob
+
+
+class Directive(object):
+    """A parsed nginx directive with its arguments and an optional block."""
+
+    def __init__(self, name, args, block=None, filename=None, line=None):
+        self.name = name
+        self.args = args
+        self.block = block
+        self.filename = filename
+        self.line = line
+
+    def __repr__(self):
+        return '<Directive %s %s>' % (self.name, ' '.join(self.args))
+
+    def find(self, name):
+        """Returns the directives called ``name`` in the block of this directive."""
+        return [d for d in self.block or [] if d.name == name]
+
+    def first(self, name, default=None):
+        found = self.find(name)
+        return found[0] if found else default
+
+
+def tokenize(text):
+    """Yields (token, line) tuples. Quoted strings are unquoted."""
+    token, line, quote = None, 1, None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if quote:
+            if c == '\\' and i + 1 < len(text):
+                token += text[i + 1]
+                i += 1
+            elif c == quote:
+                yield token, line
+                token, quote = None, None
+            else:
+                token += c
+            if c == '\n':
+                line += 1
+        elif c in '"\'' and token is None:
+            quote, token = c, ''
+        elif c == '#' and token is None:
+            while i < len(text) and text[i] != '\n':
+                i += 1
+            continue
+        elif c.isspace() or c in '{};':
+            if token is not None:
+                yield token, line
+                token = None
+            if c in '{};':
+                yield c, line
+            if c == '\n':
+                line += 1
+        else:
+            token = (token or '') + c
+        i += 1
+    if token is not None:
+        yield token, line
+
+
+def parse(text, filename=None):
+    """Returns the list of directives in ``text``."""
+    stack = [[]]
+    name, args, start = None, [], None
+    for token, line in tokenize(text):
+        if token == '{':
+            directive = Directive(name, args, [], filename, start)
+            stack[-1].append(directive)
+            stack.append(directive.block)
+            name, args = None, []
+        elif token == '}':
+            if len(stack) == 1:
+                raise ValueError("%s:%s: unexpected '}'" % (filename, line))
+            stack.pop()
+        elif token == ';':
+            stack[-1].append(Directive(name, args, None, filename, start))
+            name, args = None, []
+        elif name is None:
+            name, start = token, line
+        else:
+            args.append(token)
+    if len(stack) != 1 or name is not None:
+        raise ValueError("%s: unexpected end of file" % filename)
+    return stack[0]
+
+
+def load(filename, include=True):
+    """
+    Parses the file ``filename``. With ``include`` the files matched by ``include``
+    directives are parsed and inserted in place.
+    """
+    with open(filename) as fp:
+        directives = parse(fp.read(), filename)
+    if include:
+        directives = _expand(directives, os.path.dirname(os.path.abspath(filename)))
+    return directives
+
+
+def _expand(directives, base):
+    expanded = []
+    for directive in directives:
+        if directive.name == 'include' and directive.args:
+            pattern = os.path.join(base, directive.args[0])
+            for path in sorted(glob.glob(pattern)):
+                expanded.extend(load(path))
+        else:
+            if directive.block is not None:
+                directive.block = _expand(directive.block, base)
+            expanded.append(directive)
+    return expanded
+
+
+def walk(directives):
+    """Yields all directives recursively."""
+    for directive in directives:
+        yield directive
+        if directive.block:
+            for child in walk(directive.block):
+                yield child
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Validation and signalling of a running nginx master process."""
+
+import os
+import glob
+import time
+import signal
+import hashlib
+import subprocess
+
+
+def config_digest(etc_directory):
+    """Returns a sha256 digest of ``nginx.conf`` and the site files in ``conf.d``."""
+    digest = hashlib.sha256()
+    files = [os.path.join(etc_directory, 'nginx.conf')]
+    files += sorted(glob.glob(os.path.join(etc_directory, 'conf.d', '*.conf')))
+    for path in files:
+        if not os.path.isfile(path):
+            continue
+        digest.update(path.encode('utf-8') + b'\0')
+        with open(path, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+
+def read_pid(pid_file):
+    """Returns the pid in ``pid_file`` if that process is running, otherwise None."""
+    try:
+        with open(pid_file) as fp:
+            pid = int(fp.read().strip())
+        os.kill(pid, 0)
+    except (IOError, OSError, ValueError):
+        return None
+    return pid
+
+
+def nginx_version(nginx):
+    """Returns the version string printed by ``nginx -v`` or None if nginx is missing."""
+    if not os.path.isfile(nginx):
+        return None
+    proc = subprocess.Popen([nginx, '-v'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    return output.decode('utf-8', 'replace').strip() or None
+
+
+def test_config(nginx, prefix, conf_file):
+    """Runs ``nginx -t`` on ``conf_file``. Returns a tuple (success, output)."""
+    proc = subprocess.Popen(
+        [nginx, '-t', '-p', prefix, '-c', conf_file],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    return proc.returncode == 0, output.decode('utf-8', 'replace')
+
+
+def reload(pid):
+    """Lets the nginx master ``pid`` reload its configuration gracefully."""
+    os.kill(pid, signal.SIGHUP)
+
+
+def parent_command(pid):
+    """Returns the command line of the parent of process ``pid``, or None without ``/proc``."""
+    try:
+        with open('/proc/%d/stat' % pid) as fp:
+            # the command name in parentheses may contain spaces
+            ppid = int(fp.read().rsplit(')', 1)[1].split()[1])
+        with open('/proc/%d/cmdline' % ppid, 'rb') as fp:
+            return fp.read().replace(b'\0', b' ').decode('utf-8', 'replace').strip()
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def supervised(pid):
+    """Whether the nginx master ``pid`` was started by supervisord."""
+    command = parent_command(pid)
+    return command is not None and 'supervisord' in command
+
+
+def restart(supervisorctl, program='nginx'):
+    """Restarts the supervisor ``program``. Returns a tuple (success, output)."""
+    proc = subprocess.Popen([supervisorctl, 'restart', program], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    return proc.returncode == 0, output.decode('utf-8', 'replace')
+
+
+def _wait(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def binary_upgrade(pid_file, timeout=30):
+    """
+    Replaces the running nginx master with the new binary on the fly.
+
+    The old master starts a new master with the new binary (USR2), its workers are
+    shut down gracefully (WINCH) and the old master quits (QUIT) once the new one
+    is running. Returns the pid of the new master.
+
+    Not for a master run by supervisord with ``daemon off``: supervisord takes the
+    QUIT of the old master for an exit of the program, see ``supervised``.
+    """
+    old_pid = read_pid(pid_file)
+    if old_pid is None:
+        raise RuntimeError("nginx is not running")
+    os.kill(old_pid, signal.SIGUSR2)
+    if not _wait(lambda: read_pid(pid_file) not in (None, old_pid), timeout):
+        raise RuntimeError("new nginx master did not start, old master %d keeps running" % old_pid)
+    new_pid = read_pid(pid_file)
+    os.kill(old_pid, signal.SIGWINCH)
+    os.kill(old_pid, signal.SIGQUIT)
+    return new_pid
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Conditional downloads with a local cache."""
+
+import os
+import json
+import socket
+import hashlib
+import logging
+
+import zc.buildout
+
+from birdhousebuilder.recipe.nginx._compat import urlopen, Request, HTTPError, URLError
+
+LOGGER = logging.getLogger('nginx-fetch')
+
+
+def _read(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def write_if_changed(path, data, mode=None):
+    """
+    Writes ``data`` atomically to ``path`` unless the file has this content already.
+
+    Returns True when the file was written.
+    """
+    if os.path.isfile(path) and _read(path) == data:
+        return False
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(data)
+    if mode is not None:
+        os.chmod(tmp, mode)
+    os.rename(tmp, path)
+    return True
+
+
+def fetch(url, cache_file, timeout=30, sha256=None, offline=False):
+    """
+    Returns the content of ``url`` and keeps a copy in ``cache_file``.
+
+    A cached copy is revalidated with a conditional request (ETag and Last-Modified)
+    and reused when the server answers ``304 Not Modified`` or can not be reached.
+    In ``offline`` mode only the cached copy is used. With ``sha256`` the content
+    must match this checksum.
+    """
+    meta_file = cache_file + '.json'
+    cached = os.path.isfile(cache_file)
+    try:
+        with open(meta_file) as fp:
+            meta = json.load(fp)
+    except (IOError, ValueError):
+        meta = {}
+    if meta.get('url') != url:
+        cached, meta = False, {}
+
+    if offline:
+        if not cached:
+            raise zc.buildout.UserError("Offline and no cached copy of %s" % url)
+        data = _read(cache_file)
+    else:
+        headers = {'User-Agent': 'birdhousebuilder.recipe.nginx'}
+        if cached and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if cached and meta.get('last-modified'):
+            headers['If-Modified-Since'] = meta['last-modified']
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=timeout)
+            try:
+                data = response.read()
+                meta = {'url': url,
+                        'etag': response.headers.get('ETag'),
+                        'last-modified': response.headers.get('Last-Modified')}
+            finally:
+                response.close()
+        except HTTPError as err:
+            if err.code != 304 or not cached:
+                raise zc.buildout.UserError("Could not download %s: %s" % (url, err))
+            LOGGER.debug("Not modified: %s", url)
+            data = _read(cache_file)
+        except (URLError, socket.timeout, socket.error) as err:
+            if not cached:
+                raise zc.buildout.UserError("Could not download %s: %s" % (url, err))
+            LOGGER.warning("Could not download %s, using cached copy: %s", url, err)
+            data = _read(cache_file)
+
+    if sha256 and hashlib.sha256(data).hexdigest() != sha256.lower():
+        raise zc.buildout.UserError("Checksum mismatch of %s" % url)
+    write_if_changed(cache_file, data)
+    write_if_changed(meta_file, json.dumps(meta, sort_keys=True).encode('utf-8'))
+    return data
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""Build-time precompression of static files for ``gzip_static``."""
+
+import io
+import os
+import gzip
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from birdhousebuilder.recipe.nginx._render import file_state
+
+LOGGER = logging.getLogger('nginx-precompress')
+
+SUFFIXES = ('.gz', '.br')
+
+
+def find_files(roots, extensions, min_size=0):
+    """Yields the files below ``roots`` with one of ``extensions`` and at least ``min_size`` bytes."""
+    extensions = tuple(ext.lower() for ext in extensions)
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(extensions):
+                    continue
+                path = os.path.join(dirpath, filename)
+                if os.path.isfile(path) and os.path.getsize(path) >= min_size:
+                    yield path
+
+
+def _write(path, data, mtime):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(data)
+    os.utime(tmp, (mtime, mtime))
+    os.rename(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def compress_file(path, level=9, use_brotli=True):
+    """
+    Writes ``path.gz`` and, with the brotli module, ``path.br``.
+
+    The compressed files get the mtime of ``path`` so that nginx sends the same
+    Last-Modified and ETag headers. Compressed files which are not smaller than the
+    original are removed. Returns the list of written files.
+    """
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    mtime = os.stat(path).st_mtime
+    written = []
+    buf = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=level, mtime=int(mtime)) as fp:
+        fp.write(data)
+    compressed = buf.getvalue()
+    if len(compressed) < len(data):
+        _write(path + '.gz', compressed, mtime)
+        written.append(path + '.gz')
+    else:
+        _remove(path + '.gz')
+    if use_brotli and brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            _write(path + '.br', compressed, mtime)
+            written.append(path + '.br')
+        else:
+            _remove(path + '.br')
+    return written
+
+
+def _compress(args):
+    path, level, use_brotli = args
+    try:
+        return path, compress_file(path, level, use_brotli), None
+    except Exception as err:
+        return path, [], str(err)
+
+
+def precompress(roots, extensions, manifest, min_size=0, level=9, use_brotli=True, workers=None):
+    """
+    Precompresses the static files below ``roots`` in a process pool.
+
+    ``manifest`` records the size and mtime of each compressed file, unchanged files
+    are skipped. Compressed siblings of removed files are deleted.
+    Returns the number of compressed files.
+    """
+    use_brotli = use_brotli and brotli is not None
+    files = list(find_files(roots, extensions, min_size))
+    todo = []
+    for path in files:
+        entry = manifest.get(path)
+        if entry and entry.get('state') == file_state(path) and entry.get('brotli') == use_brotli and \
+                all(os.path.exists(p) for p in entry.get('written', [])):
+            continue
+        todo.append((path, level, use_brotli))
+    for path in set(manifest.entries) - set(files):
+        for suffix in SUFFIXES:
+            _remove(path + suffix)
+        manifest.remove(path)
+    if not todo:
+        return 0
+    if workers == 1 or len(todo) == 1:
+        results = [_compress(args) for args in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_compress, todo, chunksize=max(1, len(todo) // 64)))
+    for path, written, error in results:
+        if error:
+            LOGGER.warning("Could not compress %s: %s", path, error)
+            continue
+        manifest.set(path, {'state': file_state(path), 'brotli': use_brotli, 'written': written})
+    LOGGER.info("Precompressed %d files.", len(todo))
+    return len(todo)
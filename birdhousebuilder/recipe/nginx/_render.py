@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""Template compile cache and manifest of rendered files."""
+
+import os
+import json
+import hashlib
+
+from mako.template import Template
+
+_templates = {}
+
+
+def load_template(filename, module_directory=None):
+    """
+    Returns the compiled Mako template for ``filename``.
+
+    Templates are kept in memory keyed on path and mtime. With a ``module_directory``
+    Mako also keeps the compiled python module on disk and only recompiles it when
+    the template file is newer.
+    """
+    filename = os.path.abspath(filename)
+    key = (filename, os.stat(filename).st_mtime, module_directory)
+    if key not in _templates:
+        for old_key in [k for k in _templates if k[0] == filename]:
+            del _templates[old_key]
+        _templates[key] = Template(filename=filename, module_directory=module_directory)
+    return _templates[key]
+
+
+def fingerprint(*args):
+    """Returns a sha256 hex digest of the json representation of ``args``."""
+    data = json.dumps(args, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def file_state(path):
+    """Returns (size, mtime) of ``path`` or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class Manifest(object):
+    """
+    Json file with a record for each file rendered by the recipe.
+
+    A record holds the fingerprint of the render inputs, the sha256 of the rendered
+    text and the size/mtime of the file after it was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        try:
+            with open(path) as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, key, default=None):
+        return self.entries.get(key, default)
+
+    def set(self, key, value):
+        if self.entries.get(key) != value:
+            self.entries[key] = value
+            self.changed = True
+
+    def remove(self, key):
+        if key in self.entries:
+            del self.entries[key]
+            self.changed = True
+
+    def is_current(self, location, inputs):
+        """True if ``location`` was rendered from ``inputs`` and is untouched since."""
+        entry = self.get(location)
+        return bool(entry) and entry.get('inputs') == inputs and entry.get('state') == file_state(location)
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.entries, fp, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+        self.changed = False
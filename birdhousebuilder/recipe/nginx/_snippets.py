@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+"""Generators for nginx configuration snippets injected into the recipe options."""
+
+import re
+import math
+
+import zc.buildout
+
+SERVER_FLAGS = ('backup', 'down', 'resolve', 'drain')
+
+
+def split_servers(value):
+    """
+    Splits the ``upstream-servers`` option into a list of server entries.
+
+    Servers are separated by whitespace or newlines. Parameters like ``weight=2`` or
+    ``backup`` belong to the preceding server::
+
+        >>> split_servers('127.0.0.1:8091 weight=2 unix:/tmp/app.socket backup')
+        ['127.0.0.1:8091 weight=2', 'unix:/tmp/app.socket backup']
+    """
+    servers = []
+    for token in (value or '').split():
+        if servers and ('=' in token or token in SERVER_FLAGS):
+            servers[-1] += ' ' + token
+        else:
+            servers.append(token)
+    return servers
+
+
+def upstream_block(name, servers, balance='round_robin', keepalive=32, keepalive_requests=1000,
+                   keepalive_timeout='60s', max_fails='1', fail_timeout='10s', zone='64k'):
+    """
+    Returns an ``upstream`` block with a pool of idle keepalive connections.
+
+    The shared memory ``zone`` is named ``upstream_<name>``, so it does not clash
+    with proxy cache and limit zones of the same name.
+    """
+    lines = ['upstream %s {' % name]
+    if zone:
+        lines.append('    zone upstream_%s %s;' % (name, zone))
+    balance = balance.strip()
+    if balance.startswith('hash '):
+        key = balance.split(None, 1)[1]
+        if not key.endswith(' consistent'):
+            key += ' consistent'
+        lines.append('    hash %s;' % key)
+    elif balance in ('least_conn', 'ip_hash', 'random'):
+        lines.append('    %s;' % balance)
+    elif balance not in ('', 'round_robin'):
+        raise zc.buildout.UserError("Unknown upstream-balance method: %s" % balance)
+    for server in servers:
+        params = server.split()[1:]
+        if max_fails and not [p for p in params if p.startswith('max_fails=')]:
+            server += ' max_fails=%s' % max_fails
+        if fail_timeout and not [p for p in params if p.startswith('fail_timeout=')]:
+            server += ' fail_timeout=%s' % fail_timeout
+        lines.append('    server %s;' % server)
+    if int(keepalive) > 0:
+        lines.append('    keepalive %s;' % keepalive)
+        lines.append('    keepalive_requests %s;' % keepalive_requests)
+        lines.append('    keepalive_timeout %s;' % keepalive_timeout)
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def proxy_keepalive():
+    """Returns the proxy settings needed to reuse upstream keepalive connections."""
+    return '\n'.join([
+        'proxy_http_version 1.1;',
+        'proxy_set_header Connection "";',
+    ])
+
+
+def proxy_streaming():
+    """
+    Returns the proxy settings to stream request bodies and responses without buffering.
+
+    Unbuffered request bodies need HTTP/1.1 to the upstream, use it together with
+    ``proxy_keepalive()``, which sets ``proxy_http_version``.
+    """
+    return '\n'.join([
+        'proxy_request_buffering off;',
+        'proxy_buffering off;',
+    ])
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def expires_map(value, immutable=''):
+    """
+    Returns the maps of responses to ``expires`` times and ``Cache-Control`` headers.
+
+    ``value`` has a content type (prefix) and an ``expires`` time per line, for
+    example ``image/ 30d``. Other content types get no caching headers. Files matching
+    the ``immutable`` regex get no ``expires`` but a single immutable ``Cache-Control``.
+    """
+    lines = ['map $sent_http_content_type $expires_by_type {', '    default off;']
+    for line in (value or '').splitlines():
+        tokens = line.split()
+        if not tokens:
+            continue
+        if len(tokens) != 2:
+            raise zc.buildout.UserError("Invalid static-cache-expires line: %s" % line)
+        lines.append('    ~^%s %s;' % (re.sub(r'([.+])', r'\\\1', tokens[0]), tokens[1]))
+    lines += ['}', 'map $uri $expires {', '    default $expires_by_type;']
+    # the regex has to be quoted when it contains braces
+    if immutable:
+        lines.append('    "~*%s" off;' % immutable)
+    lines += ['}', 'map $uri $static_cache_control {', '    default "";']
+    if immutable:
+        lines.append('    "~*%s" "%s";' % (immutable, IMMUTABLE_CACHE_CONTROL))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def static_cache():
+    """
+    Returns the snippet sending the caching headers of the ``expires_map`` maps.
+
+    It sets no location, so it applies to files of any location of the server, including
+    aliased and proxied ones. Locations with their own ``add_header`` need the snippet too.
+    """
+    return '\n'.join([
+        'expires $expires;',
+        'add_header Cache-Control $static_cache_control;',
+    ])
+
+
+def cache_zones(value):
+    """
+    Parses the ``proxy-cache-zones`` option.
+
+    Each line declares a zone: its name, the size of the ``keys_zone`` and optional
+    ``proxy_cache_path`` parameters, for example ``wps 10m inactive=60m max_size=1g``.
+    Returns a list of (name, size, params) tuples with defaults applied.
+    """
+    zones = []
+    for line in (value or '').splitlines():
+        tokens = line.split()
+        if not tokens:
+            continue
+        name, size = tokens[0], '10m'
+        if len(tokens) > 1 and '=' not in tokens[1]:
+            size = tokens[1]
+            tokens = tokens[2:]
+        else:
+            tokens = tokens[1:]
+        params = [('levels', '1:2'), ('inactive', '60m'), ('use_temp_path', 'off')]
+        for token in tokens:
+            if '=' not in token:
+                raise zc.buildout.UserError("Invalid proxy-cache-zones parameter: %s" % token)
+            key, val = token.split('=', 1)
+            params = [p for p in params if p[0] != key] + [(key, val)]
+        zones.append((name, size, params))
+    return zones
+
+
+def proxy_cache_path(directory, name, size, params):
+    """Returns the ``proxy_cache_path`` directive of a cache zone below ``directory``."""
+    return 'proxy_cache_path %s levels=%s keys_zone=%s:%s %s;' % (
+        directory, dict(params)['levels'], name, size,
+        ' '.join('%s=%s' % p for p in params if p[0] != 'levels'))
+
+
+PROXY_CACHE_SKIP = '$proxy_cache_skip'
+
+
+def proxy_cache_map(requests):
+    """
+    Returns the map of the ``request`` query argument to ``$proxy_cache_skip``.
+
+    Only responses to the ``requests`` (case insensitive, for example the WPS
+    ``GetCapabilities``) are cached, other requests and requests without the argument
+    bypass the cache. Returns an empty string without ``requests``.
+    """
+    requests = (requests or '').split()
+    if not requests:
+        return ''
+    return '\n'.join([
+        'map $arg_request %s {' % PROXY_CACHE_SKIP,
+        '    default 1;',
+        '    "~*^(%s)$" 0;' % '|'.join(re.escape(request) for request in requests),
+        '}',
+    ])
+
+
+def proxy_cache(zone, valid, skip=''):
+    """
+    Returns the snippet to enable caching with ``zone`` in a location.
+
+    Responses are not cached nor served from the cache when the ``skip`` variable is
+    set. The ``X-Cache-Status`` response header reports hits and misses.
+    """
+    lines = ['proxy_cache %s;' % zone]
+    if skip:
+        lines.append('proxy_cache_bypass %s;' % skip)
+        lines.append('proxy_no_cache %s;' % skip)
+    lines.append('add_header X-Cache-Status $upstream_cache_status;')
+    for line in (valid or '').splitlines():
+        if line.strip():
+            lines.append('proxy_cache_valid %s;' % line.strip())
+    return '\n'.join(lines)
+
+
+OUTPUTS_THREAD_POOL = 'outputs'
+
+
+def outputs_locations(root, url, internal_url, directio='4m', upstream='', slice_size='', cache_zone='',
+                      cache_valid='7d'):
+    """
+    Returns the locations serving large output files below ``root``.
+
+    The ``internal_url`` location serves files handed off by the application with an
+    ``X-Accel-Redirect`` header. Files are read in the ``outputs`` thread pool, files
+    larger than ``directio`` bypass the page cache. With an ``upstream`` the public
+    ``url`` proxies to it and caches the responses in ``slice_size`` byte ranges,
+    otherwise the files are served from ``root``.
+    """
+    root = root.rstrip('/') + '/'
+    file_io = [
+        '    aio threads=%s;' % OUTPUTS_THREAD_POOL,
+        '    directio %s;' % directio,
+        '    output_buffers 2 1m;',
+    ]
+    lines = ['location ^~ %s/ {' % internal_url.rstrip('/'), '    internal;', '    alias %s;' % root]
+    lines += file_io + ['}', 'location ^~ %s/ {' % url.rstrip('/')]
+    if upstream and cache_zone:
+        lines += [
+            '    slice %s;' % slice_size,
+            '    proxy_cache %s;' % cache_zone,
+            '    proxy_cache_key $uri$is_args$args$slice_range;',
+            '    proxy_set_header Range $slice_range;',
+            '    proxy_cache_valid 200 206 %s;' % cache_valid,
+            '    proxy_http_version 1.1;',
+            '    proxy_set_header Connection "";',
+            '    proxy_pass %s;' % upstream,
+        ]
+    elif upstream:
+        lines += ['    proxy_pass %s;' % upstream]
+    else:
+        lines += ['    alias %s;' % root] + file_io
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+# bytes of shared memory per key on 64-bit platforms with the $binary_remote_addr key,
+# other keys are longer
+LIMIT_STATE_SIZE = {'req': 128, 'conn': 64}
+LIMIT_PARAMS = {
+    'req': {'clients': '10000', 'size': '', 'rate': '10r/s', 'burst': '20', 'delay': '', 'nodelay': '',
+            'status': ''},
+    'conn': {'clients': '10000', 'size': '', 'conn': '10', 'status': ''},
+}
+RATE_PATTERN = re.compile(r'^\d+r/[sm]$')
+
+
+def zone_size(clients, state_size):
+    """
+    Returns the shared memory size for ``clients`` distinct keys of ``state_size`` bytes.
+
+    The size has 25% headroom and is at least 32k, the smallest zone nginx accepts::
+
+        >>> zone_size(10000, 128)
+        '2m'
+    """
+    kbytes = max(32, int(math.ceil(int(clients) * state_size * 1.25 / 1024)))
+    if kbytes >= 1024:
+        return '%dm' % int(math.ceil(kbytes / 1024.0))
+    return '%dk' % kbytes
+
+
+def limit_zones(value, kind, clients='10000'):
+    """
+    Parses the ``limit-req-zones`` (``kind`` req) or ``limit-conn-zones`` (``kind`` conn) option.
+
+    Each line declares a zone: its name, an optional key (default ``$binary_remote_addr``)
+    and parameters, for example ``wps rate=5r/s burst=10 nodelay clients=50000``.
+    Unless ``size`` is given the zone is sized from the expected number of ``clients``.
+    Returns a list of (name, key, params) tuples with defaults applied.
+    """
+    zones = []
+    for line in (value or '').splitlines():
+        tokens = line.split()
+        if not tokens:
+            continue
+        name, key = tokens[0], '$binary_remote_addr'
+        tokens = tokens[1:]
+        if tokens and tokens[0].startswith('$'):
+            key = tokens.pop(0)
+        params = dict(LIMIT_PARAMS[kind], clients=clients)
+        for token in tokens:
+            param, _, val = token.partition('=')
+            if param not in params or (param == 'nodelay') == bool(val):
+                raise zc.buildout.UserError("Invalid limit-%s-zones parameter: %s" % (kind, token))
+            params[param] = val or 'on'
+        if kind == 'req' and not RATE_PATTERN.match(params['rate']):
+            raise zc.buildout.UserError("Invalid limit-req-zones rate: %s" % params['rate'])
+        if not params['size']:
+            state_size = LIMIT_STATE_SIZE[kind] * (1 if key == '$binary_remote_addr' else 2)
+            params['size'] = zone_size(params['clients'], state_size)
+        zones.append((name, key, params))
+    return zones
+
+
+def limit_zone(name, key, params, kind):
+    """Returns the ``limit_req_zone`` or ``limit_conn_zone`` directive of a zone."""
+    if kind == 'req':
+        return 'limit_req_zone %s zone=%s:%s rate=%s;' % (key, name, params['size'], params['rate'])
+    return 'limit_conn_zone %s zone=%s:%s;' % (key, name, params['size'])
+
+
+def limit(name, params, kind):
+    """Returns the snippet to apply a limit zone in a server or location."""
+    if kind == 'req':
+        line = 'limit_req zone=%s' % name
+        if int(params['burst']) > 0:
+            line += ' burst=%s' % params['burst']
+        if params['nodelay']:
+            line += ' nodelay'
+        elif params['delay']:
+            line += ' delay=%s' % params['delay']
+        lines = [line + ';']
+    else:
+        lines = ['limit_conn %s %s;' % (name, params['conn'])]
+    if params['status']:
+        lines.append('limit_%s_status %s;' % (kind, params['status']))
+    return '\n'.join(lines)
+
+
+LOG_FIELDS = [
+    ('time', '$time_iso8601'),
+    ('remote_addr', '$remote_addr'),
+    ('request', '$request'),
+    ('host', '$host'),
+    ('status', '$status'),
+    ('bytes_sent', '$bytes_sent'),
+    ('request_length', '$request_length'),
+    ('request_time', '$request_time'),
+    ('upstream_addr', '$upstream_addr'),
+    ('upstream_connect_time', '$upstream_connect_time'),
+    ('upstream_header_time', '$upstream_header_time'),
+    ('upstream_response_time', '$upstream_response_time'),
+    ('upstream_cache_status', '$upstream_cache_status'),
+    ('http_referer', '$http_referer'),
+    ('http_user_agent', '$http_user_agent'),
+]
+
+
+def log_format(name, kind):
+    """
+    Returns a ``log_format`` directive with timing fields as ``json`` or ``kv``
+    (key=value) lines.
+    """
+    if kind == 'json':
+        fields = ','.join('"%s":"%s"' % field for field in LOG_FIELDS)
+        return "log_format %s escape=json '{%s}';" % (name, fields)
+    elif kind == 'kv':
+        fields = ' '.join('%s="%s"' % field for field in LOG_FIELDS)
+        return "log_format %s '%s';" % (name, fields)
+    raise zc.buildout.UserError("Unknown log-format: %s" % kind)
+
+
+def access_log(path, log_format='combined', buffer='', flush='', gzip='', condition=''):
+    """Returns an ``access_log`` directive."""
+    params = [path, log_format]
+    if buffer:
+        params.append('buffer=%s' % buffer)
+    if flush:
+        params.append('flush=%s' % flush)
+    if gzip:
+        params.append('gzip=%s' % gzip)
+    if condition:
+        params.append('if=%s' % condition)
+    return 'access_log %s;' % ' '.join(params)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""Host-aware defaults for the nginx worker and events settings."""
+
+import os
+import sys
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MAX_RLIMIT_NOFILE = 65536
+MAX_WORKER_CONNECTIONS = 16384
+MIN_WORKER_CONNECTIONS = 1024
+
+
+def cpu_count():
+    """Returns the number of CPUs usable by this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def nofile_limit():
+    """Returns the hard limit of open files or None if it is unlimited or unknown."""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        return None
+    return hard
+
+
+def auto_tune(cpus=None, nofile=None, platform=sys.platform):
+    """
+    Returns worker and events settings for a host with ``cpus`` CPUs and a hard
+    ``nofile`` limit of open files.
+
+    Each worker gets the file limit raised to the hard limit (capped). A proxied
+    request holds two connections, the client and the upstream one, so half of the
+    file descriptors are left for the upstream side and open files.
+    """
+    cpus = cpus or cpu_count()
+    if nofile is None:
+        nofile = nofile_limit()
+    rlimit = min(nofile or MAX_RLIMIT_NOFILE, MAX_RLIMIT_NOFILE)
+    linux = platform.startswith('linux')
+    return {
+        'worker-processes': str(cpus),
+        'worker-rlimit-nofile': str(rlimit),
+        'worker-connections': str(max(MIN_WORKER_CONNECTIONS, min(rlimit // 2, MAX_WORKER_CONNECTIONS))),
+        'worker-cpu-affinity': 'auto' if linux and cpus > 1 else '',
+        'events-use': 'epoll' if linux else '',
+        'multi-accept': 'on',
+    }
+
+
+STATIC_PROFILES = {
+    'off': {
+        'sendfile': 'off',
+        'sendfile-max-chunk': '',
+        'tcp-nopush': '',
+        'tcp-nodelay': '',
+        'open-file-cache-max': '',
+        'open-file-cache-inactive': '20s',
+        'open-file-cache-valid': '30s',
+        'open-file-cache-min-uses': '1',
+        'output-buffers': '',
+    },
+    'default': {
+        'sendfile': 'on',
+        'sendfile-max-chunk': '',
+        'tcp-nopush': 'on',
+        'tcp-nodelay': 'on',
+        'open-file-cache-max': '1000',
+        'open-file-cache-inactive': '20s',
+        'open-file-cache-valid': '30s',
+        'open-file-cache-min-uses': '2',
+        'output-buffers': '',
+    },
+    'high-throughput': {
+        'sendfile': 'on',
+        'sendfile-max-chunk': '1m',
+        'tcp-nopush': 'on',
+        'tcp-nodelay': 'on',
+        'open-file-cache-max': '10000',
+        'open-file-cache-inactive': '60s',
+        'open-file-cache-valid': '120s',
+        'open-file-cache-min-uses': '1',
+        'output-buffers': '4 256k',
+    },
+}
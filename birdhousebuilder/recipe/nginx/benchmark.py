@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load benchmark of rendered nginx configurations.
+
+Each profile is a set of recipe options. The recipe is installed into a temporary
+prefix and nginx is started with the recipe command, proxying to a stub upstream
+on a unix socket. A built-in HTTP load generator measures requests per second,
+latency percentiles and errors. Results are written as JSON and can be compared
+with an earlier run::
+
+    nginx-benchmark --conda-prefix /opt/conda/envs/birdhouse -o current.json
+    nginx-benchmark --conda-prefix /opt/conda/envs/birdhouse --compare baseline.json
+"""
+
+import os
+import ssl
+import sys
+import pwd
+import json
+import math
+import time
+import shlex
+import socket
+import shutil
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+STATIC_SIZE = 64 * 1024
+UPSTREAM_BODY = b'{"status": "ok", "processes": []}\n' * 64
+
+SITE_TEMPLATE = """\
+${upstream}
+
+server {
+    listen ${http_listen};
+    listen ${https_listen};
+    server_name localhost;
+    ssl_certificate ${etc_directory}/cert.pem;
+    ssl_certificate_key ${etc_directory}/cert.pem;
+    root ${var_prefix}/www;
+
+    location /static/ {
+    }
+
+    location /wps {
+        proxy_pass http://${upstream_name};
+% if upstream_keepalive != '0':
+        ${proxy_keepalive}
+% endif
+    }
+}
+"""
+
+BASE_OPTIONS = {'upstream-keepalive': '0'}
+
+PROFILES = {
+    'default': {},
+    'keepalive': {'upstream-keepalive': '32'},
+    'gzip': {'precompress': 'true'},
+    'sendfile': {'static-profile': 'high-throughput'},
+    # a full handshake for each connection
+    'tls': {'ssl-session-cache': 'off', 'ssl-session-tickets': 'off'},
+    'tls-resume': {'ssl-session-cache': 'shared:SSL:10m', 'ssl-session-timeout': '1h', 'ssl-session-tickets': 'on'},
+    'tuned': {
+        'upstream-keepalive': '32',
+        'precompress': 'true',
+        'static-profile': 'high-throughput',
+        'auto-tune': 'true',
+        'ssl-key-type': 'ec',
+        'ssl-session-cache': 'shared:SSL:10m',
+        'ssl-session-tickets': 'on',
+    },
+}
+
+# (scheme, path, request headers, a new connection per request) of each profile
+REQUESTS = {
+    'default': ('http', '/wps?service=WPS&request=GetCapabilities', {}, False),
+    'keepalive': ('http', '/wps?service=WPS&request=GetCapabilities', {}, False),
+    'gzip': ('http', '/static/app.css', {'Accept-Encoding': 'gzip'}, False),
+    'sendfile': ('http', '/static/app.css', {}, False),
+    # handshakes and session resumption are only measured on new connections
+    'tls': ('https', '/wps?service=WPS&request=GetCapabilities', {}, True),
+    'tls-resume': ('https', '/wps?service=WPS&request=GetCapabilities', {}, True),
+    'tuned': ('https', '/wps?service=WPS&request=GetCapabilities', {}, True),
+}
+
+
+class Buildout(dict):
+    """Minimal stand-in for a zc.buildout instance running a single part."""
+
+    def __init__(self, directory):
+        super(Buildout, self).__init__()
+        self._raw = {}
+        self['buildout'] = {
+            'directory': directory,
+            'parts-directory': os.path.join(directory, 'parts'),
+            'bin-directory': os.path.join(directory, 'bin'),
+            'offline': 'true',
+        }
+
+    def __missing__(self, key):
+        self[key] = self._raw[key]
+        return self[key]
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def install(directory, options):
+    """Installs the recipe with ``options`` into ``directory``. Returns the recipe."""
+    from birdhousebuilder.recipe.nginx import Recipe
+    user = pwd.getpwuid(os.getuid())[0]
+    input_file = os.path.join(directory, 'bench.conf')
+    with open(input_file, 'w') as fp:
+        fp.write(SITE_TEMPLATE)
+    part_options = {
+        'name': 'bench',
+        'prefix': os.path.join(directory, 'prefix'),
+        'user': user,
+        'etc-user': user,
+        'input': input_file,
+        'hostname': 'localhost',
+    }
+    part_options.update(options)
+    recipe = Recipe(Buildout(directory), 'bench', part_options)
+    # the nginx conda package is expected in the conda prefix already
+    recipe.conda.install = lambda update=False: ()
+    recipe.install_supervisor = lambda update: []
+    www = os.path.join(recipe.options['var-prefix'], 'www', 'static')
+    if not os.path.isdir(www):
+        os.makedirs(www)
+    with open(os.path.join(www, 'app.css'), 'w') as fp:
+        line = '.wps-process { margin: 0 auto; padding: 1em; }\n'
+        fp.write(line * (STATIC_SIZE // len(line)))
+    recipe.install()
+    return recipe
+
+
+# stub upstream
+
+async def _serve_upstream(reader, writer):
+    response = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (
+        len(UPSTREAM_BODY), UPSTREAM_BODY)
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            writer.write(response)
+            await writer.drain()
+            if b'connection: close' in head.lower():
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    writer.close()
+
+
+def run_upstream(path):
+    """Runs the stub upstream on the unix socket ``path`` until terminated."""
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_unix_server(_serve_upstream, path=path))
+    os.chmod(path, 0o777)
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.close()
+
+
+# load generator
+
+async def _read_response(reader):
+    """Reads one response. Returns (status, keep connection)."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:] if ': ' in line)
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection') != 'close'
+
+
+class ResumingContext(ssl.SSLContext):
+    """Client context which resumes the last TLS session like a browser."""
+
+    session = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super(ResumingContext, self).wrap_bio(
+            incoming, outgoing, server_side, server_hostname, session or self.session)
+
+
+def _close(writer, counts):
+    ssl_object = writer.get_extra_info('ssl_object')
+    if ssl_object is not None:
+        if ssl_object.session_reused:
+            counts['resumed'] += 1
+        context = ssl_object.context
+        if isinstance(context, ResumingContext) and ssl_object.session is not None:
+            context.session = ssl_object.session
+    writer.close()
+
+
+async def _client(connect, request, deadline, latencies, counts, new_connections=False):
+    loop = asyncio.get_event_loop()
+    writer = None
+    while loop.time() < deadline:
+        try:
+            # the latency of a new connection includes the connect and TLS handshake
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await connect()
+            writer.write(request)
+            status, keep = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                counts['errors'] += 1
+            if new_connections or not keep:
+                _close(writer, counts)
+                writer = None
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            counts['errors'] += 1
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        _close(writer, counts)
+
+
+def percentile(values, p):
+    """Returns the ``p`` percentile (nearest rank) of the sorted ``values``."""
+    if not values:
+        return None
+    index = max(0, int(math.ceil(p / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+async def _load(connect, request, connections, duration, new_connections=False):
+    loop = asyncio.get_event_loop()
+    latencies, counts = [], {'errors': 0, 'resumed': 0}
+    start = loop.time()
+    await asyncio.gather(*[
+        _client(connect, request, start + duration, latencies, counts, new_connections)
+        for _ in range(connections)])
+    elapsed = loop.time() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': counts['errors'],
+        'resumed': counts['resumed'],
+        'duration': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+def load(path, host='127.0.0.1', port=None, unix=None, scheme='http', headers=None,
+         connections=16, duration=10.0, warmup=1.0, new_connections=False):
+    """
+    Sends requests for ``path`` over ``connections`` keepalive connections for
+    ``duration`` seconds. Returns the measured statistics.
+
+    With ``new_connections`` each request opens a new connection, so the latency
+    includes the connect and the TLS handshake. The client resumes the previous TLS
+    session and ``resumed`` counts the resumed handshakes.
+    """
+    context = None
+    if scheme == 'https':
+        context = ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    def connect():
+        if unix:
+            return asyncio.open_unix_connection(unix)
+        return asyncio.open_connection(host, port, ssl=context)
+
+    lines = ['GET %s HTTP/1.1' % path, 'Host: localhost', 'User-Agent: nginx-benchmark']
+    lines.extend('%s: %s' % item for item in sorted((headers or {}).items()))
+    request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+    loop = asyncio.new_event_loop()
+    try:
+        if warmup:
+            loop.run_until_complete(_load(connect, request, connections, warmup, new_connections))
+        return loop.run_until_complete(_load(connect, request, connections, duration, new_connections))
+    finally:
+        loop.close()
+
+
+def _wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("nginx did not start listening on port %d" % port)
+
+
+def wait_for_upstream(path, process, timeout=10):
+    """Waits until the stub upstream ``process`` accepts connections on the unix socket ``path``."""
+    # the socket file exists before the upstream listens on it
+    deadline = time.time() + timeout
+    while True:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(path)
+            return
+        except OSError:
+            if time.time() > deadline or not process.is_alive():
+                raise RuntimeError("stub upstream did not listen on %s" % path)
+            time.sleep(0.01)
+        finally:
+            client.close()
+
+
+def run_profile(name, options, connections=16, duration=10.0, warmup=1.0, new_connections=None):
+    """
+    Installs and starts nginx with profile ``options`` and measures it.
+
+    ``new_connections`` overrides whether the profile opens a connection per request.
+    """
+    from birdhousebuilder.recipe.nginx import templ_cmd
+    directory = tempfile.mkdtemp(prefix='nginx-benchmark-')
+    # workers of an nginx started by root run as nobody
+    os.chmod(directory, 0o755)
+    socket_path = os.path.join(directory, 'upstream.sock')
+    upstream = multiprocessing.Process(target=run_upstream, args=(socket_path,))
+    upstream.start()
+    nginx = None
+    try:
+        wait_for_upstream(socket_path, upstream)
+        http_port, https_port = free_port(), free_port()
+        part_options = dict(BASE_OPTIONS)
+        part_options.update(options)
+        part_options.update({
+            'http-port': str(http_port),
+            'https-port': str(https_port),
+            'upstream-servers': 'unix:' + socket_path,
+        })
+        recipe = install(directory, part_options)
+        scheme, path, headers, profile_new_connections = REQUESTS.get(name, REQUESTS['default'])
+        if new_connections is None:
+            new_connections = profile_new_connections
+        port = https_port if scheme == 'https' else http_port
+        with open(os.path.join(directory, 'nginx.stderr'), 'w') as stderr:
+            nginx = subprocess.Popen(shlex.split(templ_cmd.render(**recipe.options)), stderr=stderr)
+        _wait_for_port(port)
+        result = load(path, port=port, scheme=scheme, headers=headers, connections=connections,
+                      duration=duration, warmup=warmup, new_connections=new_connections)
+        result['options'] = options
+        result['new_connections'] = new_connections
+        return result
+    finally:
+        if nginx is not None:
+            nginx.send_signal(signal.SIGQUIT)
+            try:
+                nginx.wait(10)
+            except subprocess.TimeoutExpired:
+                nginx.kill()
+        upstream.terminate()
+        upstream.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare(results, baseline, max_regression=0.1):
+    """
+    Returns a list of messages for profiles whose throughput dropped by more than
+    ``max_regression`` or whose p99 latency rose by more than it against ``baseline``.
+    """
+    messages = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base['rps'] and result['rps'] < base['rps'] * (1 - max_regression):
+            messages.append("%s: rps %.1f -> %.1f" % (name, base['rps'], result['rps']))
+        if base['p99_ms'] and result['p99_ms'] and result['p99_ms'] > base['p99_ms'] * (1 + max_regression):
+            messages.append("%s: p99 %.3fms -> %.3fms" % (name, base['p99_ms'], result['p99_ms']))
+    return messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nginx-benchmark', description=__doc__.splitlines()[1])
+    parser.add_argument('--conda-prefix', default=os.environ.get('CONDA_PREFIX'),
+                        help="conda environment with the nginx package (default: $CONDA_PREFIX)")
+    parser.add_argument('-p', '--profiles', default=','.join(sorted(PROFILES)),
+                        help="comma separated profiles: %s" % ', '.join(sorted(PROFILES)))
+    parser.add_argument('-c', '--connections', type=int, default=16)
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help="seconds per profile")
+    parser.add_argument('-w', '--warmup', type=float, default=1.0, help="warmup seconds per profile")
+    parser.add_argument('-n', '--new-connections', action='store_true', default=None,
+                        help="open a new connection for each request in all profiles "
+                             "(default: only in the TLS profiles)")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run")
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help="allowed relative regression with --compare (default: 0.1)")
+    args = parser.parse_args(argv)
+    if not args.conda_prefix:
+        parser.error("--conda-prefix is required")
+    os.environ['CONDA_PREFIX'] = args.conda_prefix
+    profiles = [name.strip() for name in args.profiles.split(',') if name.strip()]
+    unknown = [name for name in profiles if name not in PROFILES]
+    if unknown:
+        parser.error("unknown profiles: %s" % ', '.join(unknown))
+
+    results = {}
+    for name in profiles:
+        results[name] = run_profile(
+            name, PROFILES[name], connections=args.connections, duration=args.duration, warmup=args.warmup,
+            new_connections=args.new_connections)
+        sys.stderr.write("%-10s %10.1f rps  p50 %8.3fms  p99 %8.3fms  %d errors  %d resumed\n" % (
+            name, results[name]['rps'], results[name]['p50_ms'] or 0,
+            results[name]['p99_ms'] or 0, results[name]['errors'], results[name]['resumed']))
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as fp:
+            messages = compare(results, json.load(fp), args.max_regression)
+        for message in messages:
+            sys.stderr.write("regression: %s\n" % message)
+        return 1 if messages else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purge or pre-warm entries of the nginx proxy cache.
+
+The cache zones and the cache key are read from the rendered ``nginx.conf``::
+
+    nginx-cache -c ${prefix}/etc/nginx/nginx.conf purge urls.txt
+    nginx-cache -c ${prefix}/etc/nginx/nginx.conf warm urls.txt
+
+URL lists contain one URL per line, empty lines and lines starting with ``#`` are
+skipped. Use ``-`` to read the URLs from stdin.
+"""
+
+import os
+import re
+import sys
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from birdhousebuilder.recipe.nginx import _conf
+from birdhousebuilder.recipe.nginx._compat import urlparse, unquote, urlopen, Request
+
+LOGGER = logging.getLogger('nginx-cache')
+
+DEFAULT_KEY = '$scheme$proxy_host$request_uri'
+VARIABLE = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
+
+
+class Zone(object):
+    """A ``proxy_cache_path`` zone."""
+
+    def __init__(self, name, path, levels='', key=DEFAULT_KEY):
+        self.name = name
+        self.path = path
+        self.levels = [int(level) for level in levels.split(':') if level]
+        self.key = key
+
+    def filename(self, key):
+        """Returns the path of the cache file for the cache ``key``."""
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        parts, end = [], len(digest)
+        for level in self.levels:
+            parts.append(digest[end - level:end])
+            end -= level
+        return os.path.join(self.path, *(parts + [digest]))
+
+
+def read_zones(conf_file):
+    """Returns the cache zones declared in ``conf_file`` by name."""
+    zones = {}
+    for http in _conf.load(conf_file):
+        if http.name != 'http':
+            continue
+        key = http.first('proxy_cache_key')
+        key = key.args[0] if key else DEFAULT_KEY
+        for directive in http.find('proxy_cache_path'):
+            params = dict(arg.split('=', 1) for arg in directive.args[1:] if '=' in arg)
+            name = params.get('keys_zone', '').split(':')[0]
+            zones[name] = Zone(name, directive.args[0], params.get('levels', ''), key)
+    return zones
+
+
+def cache_key(template, url, method='GET'):
+    """Evaluates the nginx cache key ``template`` for a request of ``url``."""
+    parsed = urlparse(url)
+    values = {
+        'scheme': parsed.scheme,
+        'request_method': method,
+        'host': (parsed.hostname or '').lower(),
+        'http_host': parsed.netloc,
+        'server_port': str(parsed.port or (443 if parsed.scheme == 'https' else 80)),
+        'request_uri': parsed.path + ('?' + parsed.query if parsed.query else ''),
+        'uri': unquote(parsed.path),
+        'args': parsed.query,
+        'query_string': parsed.query,
+        'is_args': '?' if parsed.query else '',
+    }
+
+    def substitute(match):
+        name = match.group(1) or match.group(2)
+        if name not in values:
+            raise ValueError("Can not evaluate $%s of cache key %s" % (name, template))
+        return values[name]
+    return VARIABLE.sub(substitute, template)
+
+
+def purge(zone, urls):
+    """Removes the cache files of ``urls`` from ``zone``. Returns the purged urls."""
+    purged = []
+    for url in urls:
+        filename = zone.filename(cache_key(zone.key, url))
+        try:
+            os.remove(filename)
+        except OSError:
+            LOGGER.debug("not cached: %s", url)
+        else:
+            purged.append(url)
+            LOGGER.info("purged: %s", url)
+    return purged
+
+
+def fetch(url, timeout=30):
+    """Requests ``url`` and reads the whole body. Returns (status, cache status)."""
+    response = urlopen(Request(url, headers={'User-Agent': 'nginx-cache'}), timeout=timeout)
+    try:
+        while response.read(65536):
+            pass
+        return response.getcode(), response.headers.get('X-Cache-Status', '')
+    finally:
+        response.close()
+
+
+def warm(urls, workers=4, timeout=30):
+    """Fetches ``urls`` concurrently. Returns a list of (url, status, cache status)."""
+    def _fetch(url):
+        try:
+            status, cache_status = fetch(url, timeout)
+        except Exception as err:
+            LOGGER.warning("failed: %s: %s", url, err)
+            return url, None, ''
+        LOGGER.info("%s %s %s", status, cache_status or '-', url)
+        return url, status, cache_status
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_fetch, urls))
+
+
+def read_urls(filenames):
+    for filename in filenames:
+        fp = sys.stdin if filename == '-' else open(filename)
+        try:
+            for line in fp:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nginx-cache', description=__doc__.splitlines()[1])
+    parser.add_argument('-c', '--conf', help="rendered nginx.conf (required to purge)")
+    parser.add_argument('-z', '--zone', help="cache zone (default: the first zone)")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="concurrent requests when warming")
+    parser.add_argument('-t', '--timeout', type=float, default=30, help="request timeout in seconds")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('action', choices=['purge', 'warm'])
+    parser.add_argument('urls', nargs='+', help="files with one URL per line or - for stdin")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(message)s')
+
+    urls = list(read_urls(args.urls))
+    if args.action == 'warm':
+        results = warm(urls, args.workers, args.timeout)
+        failed = [url for url, status, _ in results if status is None]
+        print("warmed %d of %d urls" % (len(urls) - len(failed), len(urls)))
+        return 1 if failed else 0
+
+    if not args.conf:
+        parser.error("the rendered nginx.conf is required to purge")
+    zones = read_zones(args.conf)
+    if not zones:
+        parser.error("no proxy_cache_path in %s" % args.conf)
+    if args.zone:
+        if args.zone not in zones:
+            parser.error("unknown cache zone %s" % args.zone)
+        zone = zones[args.zone]
+    else:
+        zone = list(zones.values())[0]
+    purged = purge(zone, urls)
+    print("purged %d of %d urls from %s" % (len(purged), len(urls), zone.name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+Prometheus exporter for the nginx stub_status page.
+
+The status location is rendered by the recipe with ``status = true``. The exporter
+polls it over one persistent connection and serves the metrics in the Prometheus
+text format on ``/metrics``::
+
+    nginx-exporter --status http://127.0.0.1:8088/nginx_status --listen 127.0.0.1:9113
+    nginx-exporter --status http://unix:/opt/birdhouse/var/run/nginx-status.sock:/nginx_status
+
+With ``--once`` the metrics are printed once, e.g. for the node exporter textfile collector.
+"""
+
+import re
+import sys
+import time
+import socket
+import argparse
+import logging
+from http.client import HTTPConnection, HTTPException
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+LOGGER = logging.getLogger('nginx-exporter')
+
+STATUS_PATTERN = re.compile(
+    r'Active connections:\s*(\d+)\s+'
+    r'server accepts handled requests\s+(\d+)\s+(\d+)\s+(\d+)\s+'
+    r'Reading:\s*(\d+)\s+Writing:\s*(\d+)\s+Waiting:\s*(\d+)')
+STATUS_FIELDS = ('active', 'accepted', 'handled', 'requests', 'reading', 'writing', 'waiting')
+
+GAUGES = [
+    ('nginx_connections_active', 'active', "Active client connections including waiting connections."),
+    ('nginx_connections_reading', 'reading', "Connections where nginx is reading the request header."),
+    ('nginx_connections_writing', 'writing', "Connections where nginx is writing the response."),
+    ('nginx_connections_waiting', 'waiting', "Idle keepalive client connections."),
+]
+COUNTERS = [
+    ('nginx_connections_accepted', 'accepted', "Accepted client connections."),
+    ('nginx_connections_handled', 'handled', "Handled client connections."),
+    ('nginx_http_requests', 'requests', "Client requests."),
+]
+
+
+def parse_status(text):
+    """Returns the numbers of a stub_status page as dict."""
+    match = STATUS_PATTERN.search(text)
+    if match is None:
+        raise ValueError("not a stub_status page: %r" % text[:200])
+    return dict(zip(STATUS_FIELDS, [int(value) for value in match.groups()]))
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP connection over a unix socket."""
+
+    def __init__(self, path, timeout=5):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class StatusClient(object):
+    """
+    Fetches the stub_status page over one keepalive connection.
+
+    ``url`` is ``http://host:port/path`` or, like in nginx, ``http://unix:/socket:/path``.
+    The connection is opened again when nginx closed it.
+    """
+
+    def __init__(self, url, timeout=5):
+        if not url.startswith('http://'):
+            raise ValueError("unsupported status url: %s" % url)
+        location = url[len('http://'):]
+        if location.startswith('unix:'):
+            socket_path, _, self.path = location[len('unix:'):].partition(':')
+            self.connect = lambda: UnixHTTPConnection(socket_path, timeout)
+        else:
+            host, _, path = location.partition('/')
+            self.path = '/' + path
+            self.connect = lambda: HTTPConnection(host, timeout=timeout)
+        self.path = self.path or '/'
+        self.connection = None
+        self.connections = 0
+
+    def fetch(self):
+        """Returns the parsed status page."""
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = self.connect()
+                self.connections += 1
+            try:
+                self.connection.request('GET', self.path, headers={'User-Agent': 'nginx-exporter'})
+                response = self.connection.getresponse()
+                body = response.read().decode('utf-8', 'replace')
+            except (HTTPException, socket.error):
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            if response.will_close:
+                self.close()
+            if response.status != 200:
+                raise ValueError("status page returned %d" % response.status)
+            return parse_status(body)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Exporter(object):
+    """Converts status samples to Prometheus metrics with per-second rates since the last poll."""
+
+    def __init__(self, client):
+        self.client = client
+        self.last = None
+
+    def collect(self):
+        """Polls nginx and returns the metrics text."""
+        now = time.time()
+        try:
+            status = self.client.fetch()
+        except Exception as err:
+            LOGGER.warning("Could not read the nginx status: %s", err)
+            return self.format(None, None, None)
+        last, self.last = self.last, (now, status)
+        if last is None or now <= last[0]:
+            return self.format(status, None, None)
+        return self.format(status, last[1], now - last[0])
+
+    @staticmethod
+    def format(status, last, interval):
+        lines = [
+            '# HELP nginx_up Whether the nginx status page could be read.',
+            '# TYPE nginx_up gauge',
+            'nginx_up %d' % (status is not None),
+        ]
+        if status is None:
+            return '\n'.join(lines) + '\n'
+        for metric, field, text in GAUGES:
+            lines += ['# HELP %s %s' % (metric, text), '# TYPE %s gauge' % metric,
+                      '%s %d' % (metric, status[field])]
+        for metric, field, text in COUNTERS:
+            lines += ['# HELP %s_total %s' % (metric, text), '# TYPE %s_total counter' % metric,
+                      '%s_total %d' % (metric, status[field])]
+        if last is not None:
+            for metric, field, text in COUNTERS:
+                # counters start from zero when nginx was restarted
+                rate = max(0, status[field] - last[field]) / interval
+                lines += ['# HELP %s_per_second %s per second since the last poll.' % (metric, text[:-1]),
+                          '# TYPE %s_per_second gauge' % metric,
+                          '%s_per_second %.3f' % (metric, rate)]
+        return '\n'.join(lines) + '\n'
+
+
+def make_handler(exporter):
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = exporter.collect().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            LOGGER.debug(format, *args)
+    return MetricsHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nginx-exporter', description=__doc__.splitlines()[1])
+    parser.add_argument('-s', '--status', default='http://127.0.0.1:8088/nginx_status',
+                        help="url of the stub_status location")
+    parser.add_argument('-l', '--listen', default='127.0.0.1:9113', help="address of the metrics endpoint")
+    parser.add_argument('-t', '--timeout', type=float, default=5, help="status request timeout in seconds")
+    parser.add_argument('--once', action='store_true', help="print the metrics once and exit")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
+    exporter = Exporter(StatusClient(args.status, args.timeout))
+    if args.once:
+        text = exporter.collect()
+        sys.stdout.write(text)
+        return 0 if 'nginx_up 1' in text else 1
+    host, _, port = args.listen.rpartition(':')
+    server = HTTPServer((host, int(port)), make_handler(exporter))
+    LOGGER.info("Serving metrics of %s on http://%s/metrics", args.status, args.listen)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        exporter.client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+Check a rendered nginx configuration for performance anti-patterns.
+
+Parses ``nginx.conf`` with the included ``conf.d`` files, reports the findings
+and runs ``nginx -t`` with the nginx of the conda environment::
+
+    nginx-lint -c ${prefix}/etc/nginx/nginx.conf --conda-prefix $CONDA_PREFIX
+    nginx-lint -c ${prefix}/etc/nginx/nginx.conf --connections 2000 --strict
+
+The command exits with an error when nginx -t fails, when a check fails or, with
+``--strict``, when there are warnings.
+"""
+
+import os
+import re
+import sys
+import argparse
+import logging
+
+from birdhousebuilder.recipe.nginx import _conf
+from birdhousebuilder.recipe.nginx import _control
+from birdhousebuilder.recipe.nginx._tuning import cpu_count
+
+LOGGER = logging.getLogger('nginx-lint')
+
+LARGE_FILE = 1024 * 1024
+MAX_SCANNED_FILES = 5000
+DEFAULT_WORKER_CONNECTIONS = 512
+PROXY_URL = re.compile(r'^(?:https?|grpcs?)://([^/]*)')
+
+
+class Finding(object):
+    """A problem found in the configuration."""
+
+    def __init__(self, level, directive, message):
+        self.level = level
+        self.filename = directive.filename if directive is not None else None
+        self.line = directive.line if directive is not None else None
+        self.message = message
+
+    def __str__(self):
+        return '%s:%s: %s: %s' % (self.filename, self.line, self.level, self.message)
+
+
+def contexts(directives, chain=None):
+    """Yields each directive with the chain of blocks it is in, outermost first."""
+    chain = (chain or []) + [directives]
+    for directive in directives:
+        yield directive, chain
+        if directive.block is not None:
+            for item in contexts(directive.block, chain):
+                yield item
+
+
+def effective(name, chain):
+    """Returns the ``name`` directives in effect for the innermost block of ``chain``."""
+    for block in reversed(chain):
+        found = [d for d in block if d.name == name]
+        if found:
+            return found
+    return []
+
+
+def largest_file(path, limit=MAX_SCANNED_FILES):
+    """Returns the size of the largest of the first ``limit`` files below ``path``."""
+    largest, scanned = 0, 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                largest = max(largest, os.path.getsize(os.path.join(dirpath, filename)))
+            except OSError:
+                continue
+            scanned += 1
+            if scanned >= limit:
+                return largest
+    return largest
+
+
+def check_workers(directives, expected_connections):
+    findings = []
+    processes = [d for d in directives if d.name == 'worker_processes']
+    processes = processes[0].args[0] if processes else '1'
+    processes = cpu_count() if processes == 'auto' else int(processes)
+    events = [d for d in directives if d.name == 'events']
+    directive = events[0].first('worker_connections') if events else None
+    connections = int(directive.args[0]) if directive else DEFAULT_WORKER_CONNECTIONS
+    capacity = processes * connections
+    # a proxied request needs a client and an upstream connection
+    if any(d.name == 'proxy_pass' for d in _conf.walk(directives)):
+        capacity //= 2
+    if capacity < expected_connections:
+        findings.append(Finding('warning', directive or (events[0] if events else None), (
+            "%d worker processes with %d worker_connections handle about %d concurrent clients, "
+            "less than the expected %d") % (processes, connections, capacity, expected_connections)))
+    return findings
+
+
+def check_proxy_pass(directive, chain, upstreams):
+    url = directive.args[0] if directive.args else ''
+    match = PROXY_URL.match(url)
+    if match is None:
+        host = url
+    else:
+        host = match.group(1)
+    if '$' in host:
+        if not effective('resolver', chain):
+            return [Finding('error', directive,
+                            "proxy_pass %s resolves its host per request but there is no resolver" % url)]
+        return [Finding('warning', directive,
+                        "proxy_pass %s resolves its host per request, use an upstream block" % url)]
+    name = host.split(':')[0] if not host.startswith('unix:') else None
+    if name not in upstreams:
+        return [Finding('warning', directive,
+                        "proxy_pass %s without an upstream block with keepalive, "
+                        "a new connection is opened for each request" % url)]
+    if not upstreams[name].find('keepalive'):
+        return [Finding('warning', directive,
+                        "upstream %s has no keepalive, a new connection is opened for each request" % name)]
+    findings = []
+    version = effective('proxy_http_version', chain)
+    if not version or version[-1].args != ['1.1']:
+        findings.append(Finding('warning', directive,
+                                "proxy_pass %s to a keepalive upstream needs proxy_http_version 1.1" % url))
+    headers = effective('proxy_set_header', chain)
+    if not [h for h in headers if h.args[:1] and h.args[0].lower() == 'connection' and h.args[1:] == ['']]:
+        findings.append(Finding('warning', directive,
+                                "proxy_pass %s to a keepalive upstream needs proxy_set_header Connection \"\"" % url))
+    return findings
+
+
+def check_static_root(directive, chain, scanned):
+    if not directive.args or '$' in directive.args[0]:
+        return []
+    sendfile = effective('sendfile', chain)
+    if sendfile and sendfile[-1].args == ['on']:
+        return []
+    path = directive.args[0]
+    if path not in scanned:
+        scanned[path] = largest_file(path) if os.path.isdir(path) else 0
+    if scanned[path] < LARGE_FILE:
+        return []
+    return [Finding('warning', directive, "sendfile is off for %s %s with files up to %.1f MB" % (
+        directive.name, path, scanned[path] / 1048576.0))]
+
+
+def check_gzip(directive, chain):
+    if directive.args != ['on'] or effective('gzip_types', chain):
+        return []
+    return [Finding('warning', directive, "gzip on without gzip_types only compresses text/html")]
+
+
+def lint(directives, expected_connections=0):
+    """Returns the findings for the parsed configuration ``directives``."""
+    findings = check_workers(directives, expected_connections)
+    upstreams = dict((d.args[0], d) for d in _conf.walk(directives) if d.name == 'upstream' and d.args)
+    scanned = {}
+    for directive, chain in contexts(directives):
+        if directive.name == 'proxy_pass':
+            findings.extend(check_proxy_pass(directive, chain, upstreams))
+        elif directive.name in ('root', 'alias'):
+            findings.extend(check_static_root(directive, chain, scanned))
+        elif directive.name == 'gzip':
+            findings.extend(check_gzip(directive, chain))
+    return findings
+
+
+def lint_file(conf_file, expected_connections=0):
+    """Parses ``conf_file`` with its includes and returns the findings."""
+    return lint(_conf.load(conf_file), expected_connections)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nginx-lint', description=__doc__.splitlines()[1])
+    parser.add_argument('-c', '--conf', required=True, help="rendered nginx.conf")
+    parser.add_argument('--connections', type=int, default=0, help="expected concurrent clients")
+    parser.add_argument('--conda-prefix', default=os.environ.get('CONDA_PREFIX'),
+                        help="conda environment with nginx for nginx -t (default: $CONDA_PREFIX)")
+    parser.add_argument('-p', '--prefix', help="nginx prefix (default: the prefix of etc/nginx/nginx.conf)")
+    parser.add_argument('--strict', action='store_true', help="fail on warnings")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        findings = lint_file(args.conf, args.connections)
+    except (IOError, ValueError) as err:
+        LOGGER.error("Could not parse %s: %s", args.conf, err)
+        return 1
+    for finding in findings:
+        print(finding)
+    failed = [f for f in findings if f.level == 'error' or args.strict]
+    nginx = os.path.join(args.conda_prefix, 'sbin', 'nginx') if args.conda_prefix else None
+    if nginx and os.path.isfile(nginx):
+        prefix = args.prefix or os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(args.conf))))
+        success, output = _control.test_config(nginx, prefix, os.path.abspath(args.conf))
+        sys.stdout.write(output)
+        if not success:
+            return 1
+    else:
+        LOGGER.warning("Skipping nginx -t, nginx not found in the conda prefix.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+"""
+Request counts, status mix and latency percentiles from nginx access logs.
+
+Reads the access logs of the recipe, including rotated and gzip compressed logs,
+in the ``combined`` format or the ``json``/``kv`` formats of the ``log-format`` option::
+
+    nginx-logstats ${prefix}/var/log/nginx
+    nginx-logstats --by upstream --json access.log access.log.2.gz
+
+Logs are streamed line by line, files are analyzed in parallel processes and
+percentiles come from a mergeable quantile sketch, so memory stays constant.
+"""
+
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import math
+import zlib
+import fnmatch
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+LOGGER = logging.getLogger('nginx-logstats')
+
+COMBINED_PATTERN = re.compile(
+    r'^(?P<remote_addr>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<request>(?:[^"\\]|\\.)*)" '
+    r'(?P<status>\d{3}) (?P<bytes_sent>\d+|-)')
+KV_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+PERCENTILES = (50, 95, 99)
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class Sketch(object):
+    """
+    Quantile sketch with logarithmic buckets.
+
+    Quantiles are accurate to ``accuracy`` relative error, memory grows with the
+    logarithm of the value range only. Sketches of different files are merged by
+    adding the bucket counts.
+    """
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        return self
+
+    def quantile(self, q):
+        """Returns the value at quantile ``q`` (0..1) or None for an empty sketch."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class Stats(object):
+    """Aggregated requests of one location or upstream."""
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.request_time = Sketch()
+        self.upstream_time = Sketch()
+
+    def add(self, record):
+        self.requests += 1
+        status = record.get('status', '-')
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes_sent += to_int(record.get('bytes_sent'))
+        request_time = to_seconds(record.get('request_time'))
+        if request_time is not None:
+            self.request_time.add(request_time)
+        upstream_time = to_seconds(record.get('upstream_response_time'))
+        if upstream_time is not None:
+            self.upstream_time.add(upstream_time)
+
+    def merge(self, other):
+        self.requests += other.requests
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.bytes_sent += other.bytes_sent
+        self.request_time.merge(other.request_time)
+        self.upstream_time.merge(other.upstream_time)
+        return self
+
+    def report(self):
+        result = {
+            'requests': self.requests,
+            'statuses': dict(sorted(self.statuses.items())),
+            'bytes_sent': self.bytes_sent,
+        }
+        for name, sketch in (('request_time', self.request_time), ('upstream_time', self.upstream_time)):
+            for p in PERCENTILES:
+                value = sketch.quantile(p / 100.0)
+                result['%s_p%d' % (name, p)] = None if value is None else round(value, 4)
+        return result
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_seconds(value):
+    """
+    Converts a logged time to seconds. Times of several upstreams (``0.010, 0.200 : 0.004``)
+    are added up, ``-`` is None.
+    """
+    if value is None:
+        return None
+    total, found = 0.0, False
+    for part in re.split(r'[,:\s]+', value):
+        try:
+            total += float(part)
+            found = True
+        except ValueError:
+            continue
+    return total if found else None
+
+
+def open_log(path):
+    """Opens a log for reading text. Compressed logs are detected by content, not by name."""
+    with open(path, 'rb') as fp:
+        compressed = fp.read(2) == GZIP_MAGIC
+    if compressed:
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', errors='replace')
+    return io.open(path, encoding='utf-8', errors='replace')
+
+
+def parse_line(line):
+    """Returns the fields of a log line in ``json``, ``kv`` or ``combined`` format, or None."""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    if line.startswith('time="') or ' request_time="' in line:
+        return dict((key, value.replace('\\x22', '"')) for key, value in KV_PATTERN.findall(line))
+    match = COMBINED_PATTERN.match(line)
+    return match.groupdict() if match else None
+
+
+def location(request, depth=1):
+    """Returns the first ``depth`` path segments of a request line like ``GET /wps/x?a=1 HTTP/1.1``."""
+    parts = request.split(' ')
+    path = parts[1] if len(parts) > 1 else parts[0]
+    segments = [s for s in path.split('?', 1)[0].split('/') if s][:depth]
+    return '/' + '/'.join(segments)
+
+
+def group_key(record, by='location', depth=1):
+    if by == 'upstream':
+        return record.get('upstream_addr') or '-'
+    if by == 'status':
+        return record.get('status', '-')
+    return location(record.get('request', ''), depth)
+
+
+def analyze_file(path, by='location', depth=1):
+    """Returns (stats by group, number of skipped lines) of one log file."""
+    groups = {}
+    skipped = 0
+    with open_log(path) as fp:
+        for line in fp:
+            record = parse_line(line)
+            if record is None:
+                skipped += 1
+                continue
+            key = group_key(record, by, depth)
+            if key not in groups:
+                groups[key] = Stats()
+            groups[key].add(record)
+    return groups, skipped
+
+
+def _analyze(args):
+    path, by, depth = args
+    try:
+        return path, analyze_file(path, by, depth), None
+    # truncated or corrupt rotated logs fail while reading, not when they are opened
+    except (IOError, OSError, EOFError, zlib.error) as err:
+        return path, ({}, 0), str(err) or err.__class__.__name__
+
+
+def analyze(paths, by='location', depth=1, workers=None):
+    """Analyzes log files in a process pool. Returns (merged stats by group, skipped lines)."""
+    jobs = [(path, by, depth) for path in paths]
+    if workers == 1 or len(jobs) < 2:
+        results = [_analyze(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_analyze, jobs))
+    groups = {}
+    skipped = 0
+    for path, (file_groups, file_skipped), error in results:
+        if error:
+            LOGGER.warning("Could not read %s: %s", path, error)
+        skipped += file_skipped
+        for key, stats in file_groups.items():
+            if key in groups:
+                groups[key].merge(stats)
+            else:
+                groups[key] = stats
+    return groups, skipped
+
+
+def find_logs(paths, pattern='access*.log*'):
+    """Expands directories in ``paths`` to the access logs inside, largest first."""
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                        if fnmatch.fnmatch(name, pattern) and os.path.isfile(os.path.join(path, name)))
+        else:
+            logs.append(path)
+    # big files first keep the pool busy until the end
+    return sorted(logs, key=lambda log: -os.path.getsize(log) if os.path.exists(log) else 0)
+
+
+def format_table(report):
+    def ms(value):
+        return '-' if value is None else '%.1f' % (value * 1000)
+
+    lines = ['%-32s %9s %6s %6s %6s %10s %8s %8s %8s %8s %8s %8s' % (
+        'group', 'requests', '2xx', '4xx', '5xx', 'MB sent',
+        'req p50', 'p95', 'p99', 'ups p50', 'p95', 'p99')]
+    for key, stats in report:
+        classes = {}
+        for status, count in stats['statuses'].items():
+            classes[status[:1]] = classes.get(status[:1], 0) + count
+        lines.append('%-32s %9d %6d %6d %6d %10.1f %8s %8s %8s %8s %8s %8s' % (
+            key[:32], stats['requests'], classes.get('2', 0), classes.get('4', 0), classes.get('5', 0),
+            stats['bytes_sent'] / 1e6,
+            ms(stats['request_time_p50']), ms(stats['request_time_p95']), ms(stats['request_time_p99']),
+            ms(stats['upstream_time_p50']), ms(stats['upstream_time_p95']), ms(stats['upstream_time_p99'])))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='nginx-logstats', description=__doc__.splitlines()[1])
+    parser.add_argument('paths', nargs='+', help="log files or log directories")
+    parser.add_argument('-b', '--by', choices=['location', 'upstream', 'status'], default='location',
+                        help="group requests by location, upstream address or status")
+    parser.add_argument('-d', '--depth', type=int, default=1, help="path segments of a location")
+    parser.add_argument('-p', '--pattern', default='access*.log*', help="log file names in directories")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="parallel processes")
+    parser.add_argument('-n', '--top', type=int, default=0, help="only show the busiest groups")
+    parser.add_argument('--json', action='store_true', help="print the report as json")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    logs = find_logs(args.paths, args.pattern)
+    if not logs:
+        parser.error("no access logs found")
+    groups, skipped = analyze(logs, args.by, args.depth, args.workers)
+    report = sorted(((key, stats.report()) for key, stats in groups.items()), key=lambda item: -item[1]['requests'])
+    if args.top:
+        report = report[:args.top]
+    if args.json:
+        print(json.dumps(dict(report), indent=2))
+    else:
+        print(format_table(report))
+    if skipped:
+        LOGGER.info("Skipped %d lines in an unknown format.", skipped)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/bin/sh
+#
+# Rotates the nginx logs in ${log_directory} and lets nginx reopen them (USR1),
+# so that no restart is needed. Keeps ${log_rotate_keep} compressed logs.
+#
+set -e
+
+LOG_DIRECTORY="${log_directory}"
+PID_FILE="${run_directory}/nginx.pid"
+KEEP=${log_rotate_keep}
+% if access_log_gzip:
+# nginx writes this log gzip compressed already (access-log-gzip)
+GZIPPED="access.log"
+% else:
+GZIPPED=""
+% endif
+
+# compresses the logs rotated to *.log.1
+compress_rotated() {
+    for rotated in *.log.1; do
+        if [ ! -f "$rotated" ]; then
+            continue
+        fi
+        log=$(basename "$rotated" .1)
+        case " $GZIPPED " in
+            *" $log "*) mv "$rotated" "$rotated.gz" ;;
+            *) gzip -f "$rotated" ;;
+        esac
+    done
+}
+
+cd "$LOG_DIRECTORY"
+# logs left by an interrupted run would be overwritten by the rotation
+compress_rotated
+for log in *.log; do
+    if [ ! -f "$log" ]; then
+        continue
+    fi
+    i=$KEEP
+    rm -f "$log.$i.gz"
+    while [ $i -gt 1 ]; do
+        j=$((i - 1))
+        if [ -f "$log.$j.gz" ]; then
+            mv "$log.$j.gz" "$log.$i.gz"
+        fi
+        i=$j
+    done
+    mv "$log" "$log.1"
+done
+
+# skip a stale pid file of a stopped nginx
+if [ -f "$PID_FILE" ] && kill -0 "$(cat "$PID_FILE")" 2>/dev/null; then
+    kill -USR1 "$(cat "$PID_FILE")"
+    # give the workers time to reopen the logs
+    sleep 1
+fi
+
+compress_rotated
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the fingerprinted static assets.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from birdhousebuilder.recipe.nginx import _assets
+from birdhousebuilder.recipe.nginx._render import Manifest
+
+IMMUTABLE = r'\.[0-9a-f]{8,}\.(css|js|png)$'
+
+
+class AssetsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = os.path.join(self.directory, 'www')
+        os.makedirs(os.path.join(self.root, 'css'))
+        self.write('css/app.css', 'body { color: red; }')
+        self.write('js/app.js', 'console.log(1);')
+        self.write('js/vendor.0123456789ab.js', 'vendor();')
+        self.write('index.html', '<html></html>')
+        self.manifest_path = os.path.join(self.directory, 'state.json')
+        self.assets_file = os.path.join(self.root, 'assets.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+    def run_fingerprint(self, keep_days=_assets.KEEP_DAYS):
+        manifest = Manifest(self.manifest_path)
+        assets = _assets.fingerprint_assets(
+            [self.root], ['.css', '.js'], manifest, self.assets_file, IMMUTABLE, keep_days)
+        manifest.save()
+        return assets
+
+    def test_fingerprint_assets(self):
+        assets = self.run_fingerprint()
+        self.assertEqual(sorted(assets), ['css/app.css', 'js/app.js'])
+        target = os.path.join(self.root, assets['css/app.css'])
+        with open(target) as fp:
+            self.assertEqual(fp.read(), 'body { color: red; }')
+        with open(self.assets_file) as fp:
+            self.assertEqual(json.load(fp), assets)
+        # unchanged assets keep their names, changed assets get a new one
+        self.assertEqual(self.run_fingerprint(), assets)
+        self.write('css/app.css', 'body { color: blue; }')
+        # the fingerprinted copy does not change with the source
+        with open(target) as fp:
+            self.assertEqual(fp.read(), 'body { color: red; }')
+        os.utime(os.path.join(self.root, 'css', 'app.css'), (1, 1))
+        changed = self.run_fingerprint()
+        self.assertNotEqual(changed['css/app.css'], assets['css/app.css'])
+        # cached pages may still refer to the previous copy
+        self.assertTrue(os.path.exists(target))
+        self.assertEqual(self.run_fingerprint(), changed)
+        self.assertTrue(os.path.exists(target))
+        # removed assets keep their copies for the grace period too
+        os.remove(os.path.join(self.root, 'js', 'app.js'))
+        self.assertEqual(sorted(self.run_fingerprint()), ['css/app.css'])
+        self.assertTrue(os.path.exists(os.path.join(self.root, assets['js/app.js'])))
+        # and lose them after
+        self.assertEqual(sorted(self.run_fingerprint(keep_days=0)), ['css/app.css'])
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.exists(os.path.join(self.root, assets['js/app.js'])))
+        self.assertTrue(os.path.exists(os.path.join(self.root, changed['css/app.css'])))
+        self.assertEqual(sorted(Manifest(self.manifest_path).entries), [os.path.join(self.root, 'css', 'app.css')])
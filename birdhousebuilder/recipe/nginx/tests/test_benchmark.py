@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the benchmark load generator against the stub upstream.
+"""
+
+import os
+import ssl
+import shutil
+import tempfile
+import asyncio
+import unittest
+import threading
+import multiprocessing
+
+from birdhousebuilder.recipe.nginx import benchmark
+from birdhousebuilder.recipe.nginx import generate_cert
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket = os.path.join(self.directory, 'upstream.sock')
+        self.upstream = multiprocessing.Process(target=benchmark.run_upstream, args=(self.socket,))
+        self.upstream.start()
+        try:
+            benchmark.wait_for_upstream(self.socket, self.upstream, timeout=5)
+        except RuntimeError as err:
+            self.tearDown()
+            self.fail(str(err))
+
+    def tearDown(self):
+        self.upstream.terminate()
+        self.upstream.join()
+        shutil.rmtree(self.directory)
+
+    def test_load_against_stub_upstream(self):
+        result = benchmark.load('/wps', unix=self.socket, connections=4, duration=0.3, warmup=0)
+        self.assertGreater(result['requests'], 0)
+        self.assertEqual(result['errors'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_new_connections(self):
+        result = benchmark.load('/wps', unix=self.socket, connections=2, duration=0.3, warmup=0,
+                                new_connections=True)
+        self.assertGreater(result['requests'], 0)
+        self.assertEqual(result['errors'], 0)
+
+    def test_tls_sessions_are_resumed(self):
+        certfile = os.path.join(self.directory, 'cert.pem')
+        self.assertTrue(generate_cert(certfile, 'Birdhouse', 'Test', 'localhost', key_type='ec'))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile)
+        ready, stopped = threading.Event(), []
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            server = loop.run_until_complete(
+                asyncio.start_server(benchmark._serve_upstream, '127.0.0.1', 0, ssl=context))
+            self.port = server.sockets[0].getsockname()[1]
+            stopped.append(lambda: loop.call_soon_threadsafe(loop.stop))
+            ready.set()
+            loop.run_forever()
+            server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+        thread = threading.Thread(target=serve)
+        thread.start()
+        ready.wait(5)
+        try:
+            result = benchmark.load('/wps', port=self.port, scheme='https', connections=2, duration=0.5,
+                                    warmup=0, new_connections=True)
+        finally:
+            stopped[0]()
+            thread.join()
+        self.assertGreater(result['requests'], 1)
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['resumed'], 0)
+
+    def test_compare(self):
+        baseline = {'default': {'rps': 1000.0, 'p99_ms': 2.0}}
+        self.assertEqual(benchmark.compare({'default': {'rps': 950.0, 'p99_ms': 2.1}}, baseline), [])
+        self.assertEqual(len(benchmark.compare({'default': {'rps': 800.0, 'p99_ms': 3.0}}, baseline)), 2)
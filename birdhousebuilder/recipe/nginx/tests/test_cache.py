@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the proxy cache command line tool.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from birdhousebuilder.recipe.nginx import cache
+from birdhousebuilder.recipe.nginx.tests.test_recipe import make_recipe
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_key(self):
+        self.assertEqual(
+            cache.cache_key('$scheme$request_method$host$request_uri',
+                            'https://Example.org:8443/wps?service=WPS&request=GetCapabilities'),
+            'httpsGETexample.org/wps?service=WPS&request=GetCapabilities')
+        with self.assertRaises(ValueError):
+            cache.cache_key('$proxy_host$request_uri', 'http://localhost/')
+
+    def test_zone_filename(self):
+        zone = cache.Zone('wps', '/cache/wps', '1:2')
+        # md5('httpGETlocalhost/') = 'e59c4686e1048ac50e848367eccc6608'
+        self.assertEqual(zone.filename('httpGETlocalhost/'),
+                         '/cache/wps/8/60/e59c4686e1048ac50e848367eccc6608')
+
+    def test_purge_from_rendered_config(self):
+        recipe = make_recipe(self.directory, **{'proxy-cache-zones': 'wps 10m inactive=1d'})
+        recipe.install()
+        conf = os.path.join(recipe.options['etc-directory'], 'nginx.conf')
+        with open(conf) as fp:
+            text = fp.read()
+        self.assertIn('map $arg_request $proxy_cache_skip {', text)
+        self.assertIn('proxy_no_cache $proxy_cache_skip;', recipe.options['proxy_cache'])
+        zone = cache.read_zones(conf)['wps']
+        self.assertEqual(zone.path, os.path.join(recipe.options['cache-directory'], 'wps'))
+        url = 'http://localhost/wps?service=WPS&request=GetCapabilities'
+        filename = zone.filename(cache.cache_key(zone.key, url))
+        os.makedirs(os.path.dirname(filename))
+        open(filename, 'w').close()
+        self.assertEqual(cache.purge(zone, [url, 'http://localhost/other']), [url])
+        self.assertFalse(os.path.exists(filename))
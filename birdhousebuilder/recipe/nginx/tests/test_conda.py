@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the conda environment pre-check against fake conda-meta records.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from birdhousebuilder.recipe.nginx import _conda
+from birdhousebuilder.recipe.nginx.tests.test_recipe import make_recipe
+
+RECORDS = [
+    ('nginx', '1.19.6', 'h1234_0', 'https://conda.anaconda.org/conda-forge/linux-64'),
+    ('openssl', '1.1.1k', 'h27cfd23_0', 'https://repo.anaconda.com/pkgs/main/linux-64'),
+    ('pyopenssl', '20.0.1', 'pyhd3eb1b0_1', 'https://repo.anaconda.com/pkgs/main/noarch'),
+    ('cryptography', '3.4.7', 'py38hd23ed53_0', 'https://repo.anaconda.com/pkgs/main/linux-64'),
+]
+
+
+def make_env(prefix, records=RECORDS):
+    meta = os.path.join(prefix, 'conda-meta')
+    os.makedirs(meta)
+    for name, version, build, channel in records:
+        with open(os.path.join(meta, '%s-%s-%s.json' % (name, version, build)), 'w') as fp:
+            json.dump({'name': name, 'version': version, 'build': build, 'channel': channel}, fp)
+
+
+class CondaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.directory, 'env')
+        make_env(self.prefix)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_spec(self):
+        self.assertEqual(_conda.parse_spec('nginx'), ('nginx', None, None, None))
+        self.assertEqual(_conda.parse_spec('nginx=1.19=h1234_0'), ('nginx', '=', '1.19', 'h1234_0'))
+        self.assertEqual(_conda.parse_spec('nginx==1.19.6'), ('nginx', '==', '1.19.6', None))
+        self.assertIsNone(_conda.parse_spec('nginx>=1.19'))
+
+    def test_pin(self):
+        self.assertEqual(
+            _conda.pin(['nginx', 'openssl'], 'nginx', '1.19.6', 'h1234_0'),
+            ['nginx=1.19.6=h1234_0', 'openssl'])
+        self.assertEqual(_conda.pin(['openssl'], 'nginx', build='h1234_0'), ['openssl', 'nginx=*=h1234_0'])
+
+    def test_unsatisfied(self):
+        channels = ['defaults', 'conda-forge']
+        self.assertEqual(_conda.unsatisfied(self.prefix, ['nginx=1.19', 'openssl', 'cryptography'], channels), [])
+        self.assertEqual(_conda.unsatisfied(self.prefix, ['nginx==1.19'], channels), ['nginx==1.19'])
+        self.assertEqual(_conda.unsatisfied(self.prefix, ['nginx=1.19.6=h9999_0'], channels),
+                         ['nginx=1.19.6=h9999_0'])
+        self.assertEqual(_conda.unsatisfied(self.prefix, ['nginx>=1.19', 'curl'], channels), ['nginx>=1.19', 'curl'])
+        # nginx is from conda-forge, not from the requested channels
+        self.assertEqual(_conda.unsatisfied(self.prefix, ['nginx', 'openssl'], ['defaults', 'birdhouse']), ['nginx'])
+
+    def test_recipe_skips_satisfied_env(self):
+        calls = []
+        with mock.patch.dict(os.environ, {'CONDA_PREFIX': self.prefix}):
+            recipe = make_recipe(self.directory, channels='conda-forge defaults')
+            recipe.conda.install = lambda update=False: calls.append(update) or ()
+            recipe.install()
+            self.assertEqual(calls, [])
+            recipe = make_recipe(self.directory, channels='conda-forge defaults', **{'nginx-version': '1.21'})
+            self.assertIn('nginx=1.21', recipe.options['pkgs'])
+            recipe.conda.install = lambda update=False: calls.append(update) or ()
+            recipe.install()
+            self.assertEqual(calls, [False])
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the stub_status location and the prometheus exporter.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import zc.buildout
+
+from birdhousebuilder.recipe import nginx
+from birdhousebuilder.recipe.nginx import exporter
+from birdhousebuilder.recipe.nginx.tests.test_recipe import make_recipe
+
+STATUS = """Active connections: 3
+server accepts handled requests
+ 10 10 %d
+Reading: 0 Writing: 1 Waiting: 2
+"""
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    requests = 0
+
+    def do_GET(self):
+        StatusHandler.connections.add(self.client_address)
+        StatusHandler.requests += 1
+        body = (STATUS % (100 * StatusHandler.requests)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ExporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        StatusHandler.connections = set()
+        StatusHandler.requests = 0
+        self.server = HTTPServer(('127.0.0.1', 0), StatusHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/nginx_status' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_parse_status(self):
+        self.assertEqual(exporter.parse_status(STATUS % 31), {
+            'active': 3, 'accepted': 10, 'handled': 10, 'requests': 31, 'reading': 0, 'writing': 1, 'waiting': 2})
+        with self.assertRaises(ValueError):
+            exporter.parse_status('<html>not found</html>')
+
+    def test_collect_reuses_connection(self):
+        client = exporter.StatusClient(self.url)
+        metrics = exporter.Exporter(client)
+        text = metrics.collect()
+        self.assertIn('nginx_up 1', text)
+        self.assertIn('nginx_connections_waiting 2', text)
+        self.assertIn('nginx_http_requests_total 100', text)
+        self.assertNotIn('per_second', text)
+        text = metrics.collect()
+        self.assertIn('nginx_http_requests_total 200', text)
+        self.assertIn('nginx_http_requests_per_second', text)
+        self.assertIn('nginx_connections_accepted_per_second 0.000', text)
+        self.assertEqual(client.connections, 1)
+        self.assertEqual(len(StatusHandler.connections), 1)
+        client.close()
+
+    def test_nginx_down(self):
+        metrics = exporter.Exporter(exporter.StatusClient('http://127.0.0.1:1/nginx_status', timeout=1))
+        self.assertEqual(metrics.collect().splitlines()[-1], 'nginx_up 0')
+
+
+class StatusLocationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_status_url(self):
+        self.assertEqual(nginx.status_url('127.0.0.1:8088', '/nginx_status'), 'http://127.0.0.1:8088/nginx_status')
+        self.assertEqual(nginx.status_url('unix:/tmp/status.sock', '/nginx_status'),
+                         'http://unix:/tmp/status.sock:/nginx_status')
+        with self.assertRaises(zc.buildout.UserError):
+            nginx.status_url('0.0.0.0:8088', '/nginx_status')
+
+    def test_status_conf(self):
+        recipe = make_recipe(self.directory, status='true')
+        recipe.install()
+        status_conf = os.path.join(recipe.options['etc-directory'], 'conf.d', 'nginx-status.conf')
+        with open(status_conf) as fp:
+            text = fp.read()
+        self.assertIn('listen 127.0.0.1:8088;', text)
+        self.assertIn('location = /nginx_status {', text)
+        self.assertIn('deny all;', text)
+        make_recipe(self.directory).update()
+        self.assertFalse(os.path.exists(status_conf))
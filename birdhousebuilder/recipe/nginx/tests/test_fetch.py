@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the cached CA bundle download against a local http server.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import zc.buildout
+
+from birdhousebuilder.recipe.nginx import _fetch
+from birdhousebuilder.recipe.nginx.tests.test_recipe import make_recipe
+
+BUNDLE = b'-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----\n'
+
+
+class BundleHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(BUNDLE)))
+        self.end_headers()
+        self.wfile.write(BUNDLE)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        BundleHandler.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), BundleHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/ca-bundle.crt' % self.server.server_port
+        self.cache_file = os.path.join(self.directory, 'cache', 'ca-bundle.crt')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_conditional_request(self):
+        self.assertEqual(_fetch.fetch(self.url, self.cache_file), BUNDLE)
+        self.assertEqual(_fetch.fetch(self.url, self.cache_file), BUNDLE)
+        self.assertEqual(BundleHandler.requests, [None, '"v1"'])
+
+    def test_offline_and_checksum(self):
+        with self.assertRaises(zc.buildout.UserError):
+            _fetch.fetch(self.url, self.cache_file, offline=True)
+        with self.assertRaises(zc.buildout.UserError):
+            _fetch.fetch(self.url, self.cache_file, sha256='0' * 64)
+        _fetch.fetch(self.url, self.cache_file, sha256=hashlib.sha256(BUNDLE).hexdigest())
+        self.assertEqual(_fetch.fetch(self.url, self.cache_file, offline=True), BUNDLE)
+        self.assertEqual(len(BundleHandler.requests), 2)
+
+    def test_bundle_is_only_rewritten_on_change(self):
+        options = {'ssl-verify-client': 'on', 'ssl-client-certificate-url': self.url}
+        recipe = make_recipe(self.directory, **options)
+        recipe.install()
+        bundle = os.path.join(recipe.options['etc-directory'], 'esgf-ca-bundle.crt')
+        with open(bundle, 'rb') as fp:
+            self.assertEqual(fp.read(), BUNDLE)
+        mtime = os.stat(bundle).st_mtime_ns
+        make_recipe(self.directory, **options).update()
+        self.assertEqual(os.stat(bundle).st_mtime_ns, mtime)
+        self.assertEqual(BundleHandler.requests, [None, '"v1"'])
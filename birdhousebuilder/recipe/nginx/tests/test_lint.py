@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the performance lint of rendered configurations.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import zc.buildout
+
+from birdhousebuilder.recipe.nginx import lint
+from birdhousebuilder.recipe.nginx import _conf
+from birdhousebuilder.recipe.nginx.tests.test_recipe import make_recipe
+
+CONFIG = """\
+worker_processes 2;
+events {
+    worker_connections 1024;
+}
+http {
+    sendfile on;
+    gzip on;
+    gzip_types text/css application/json;
+    proxy_http_version 1.1;
+    proxy_set_header Connection "";
+    upstream app {
+        server unix:/tmp/app.sock;
+        keepalive 16;
+    }
+    include conf.d/*.conf;
+}
+"""
+
+SITE = """\
+server {
+    listen 8080;
+    location / {
+        proxy_pass http://app;
+    }
+}
+"""
+
+
+def messages(findings):
+    return [finding.message for finding in findings]
+
+
+class LintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_config(self, site, config=CONFIG):
+        os.makedirs(os.path.join(self.directory, 'conf.d'))
+        with open(os.path.join(self.directory, 'nginx.conf'), 'w') as fp:
+            fp.write(config)
+        with open(os.path.join(self.directory, 'conf.d', 'site.conf'), 'w') as fp:
+            fp.write(site)
+        return os.path.join(self.directory, 'nginx.conf')
+
+    def test_clean_config(self):
+        conf_file = self.write_config(SITE)
+        self.assertEqual(lint.lint_file(conf_file, expected_connections=1000), [])
+
+    def test_keepalive(self):
+        findings = lint.lint(_conf.parse(
+            "http { upstream app { server 127.0.0.1:8000; } "
+            "server { location / { proxy_pass http://app; } location /b { proxy_pass http://127.0.0.1:9000/b; } } }"))
+        self.assertEqual(messages(findings), [
+            "upstream app has no keepalive, a new connection is opened for each request",
+            "proxy_pass http://127.0.0.1:9000/b without an upstream block with keepalive, "
+            "a new connection is opened for each request"])
+        findings = lint.lint(_conf.parse(
+            "http { upstream app { server 127.0.0.1:8000; keepalive 8; } "
+            "server { location / { proxy_set_header Host $host; proxy_pass http://app; } } }"))
+        self.assertEqual(len(findings), 2)
+        self.assertIn('proxy_http_version 1.1', findings[0].message)
+        self.assertIn('Connection', findings[1].message)
+
+    def test_per_request_dns(self):
+        conf_file = self.write_config("server { location / { proxy_pass http://$backend:8000; } }")
+        findings = lint.lint_file(conf_file)
+        self.assertEqual([(f.level, f.line) for f in findings], [('error', 1)])
+        self.assertTrue(findings[0].filename.endswith('site.conf'))
+        findings = lint.lint(_conf.parse(
+            "http { resolver 127.0.0.53; server { location / { proxy_pass http://$backend:8000; } } }"))
+        self.assertEqual([f.level for f in findings], ['warning'])
+
+    def test_sendfile_off(self):
+        www = os.path.join(self.directory, 'www')
+        os.makedirs(www)
+        with open(os.path.join(www, 'small.txt'), 'w') as fp:
+            fp.write('x')
+        config = "http { sendfile off; server { root %s; location /s { sendfile on; alias %s; } } }"
+        self.assertEqual(lint.lint(_conf.parse(config % (www, www))), [])
+        with open(os.path.join(www, 'large.nc'), 'wb') as fp:
+            fp.truncate(2 * lint.LARGE_FILE)
+        findings = lint.lint(_conf.parse(config % (www, www)))
+        self.assertEqual(messages(findings), ["sendfile is off for root %s with files up to 2.0 MB" % www])
+
+    def test_gzip_types(self):
+        findings = lint.lint(_conf.parse("http { gzip on; server { gzip_types text/css; } }"))
+        self.assertEqual(messages(findings), ["gzip on without gzip_types only compresses text/html"])
+
+    def test_worker_connections(self):
+        conf_file = self.write_config(SITE)
+        findings = lint.lint_file(conf_file, expected_connections=2000)
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0].line, 3)
+        self.assertIn('about 1024 concurrent clients', findings[0].message)
+
+    def test_main(self):
+        conf_file = self.write_config("server { location / { proxy_pass http://app; gzip on; } }")
+        self.assertEqual(lint.main(['-c', conf_file, '--conda-prefix', self.directory]), 0)
+        self.assertEqual(lint.main(['-c', conf_file, '--conda-prefix', self.directory, '--strict']), 0)
+        conf_file = os.path.join(self.directory, 'conf.d', 'site.conf')
+        with open(conf_file, 'w') as fp:
+            fp.write("server { gzip on; }")
+        self.assertEqual(lint.main(['-c', conf_file, '--conda-prefix', self.directory, '--strict']), 1)
+
+
+class RecipeLintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_strict(self):
+        with open(os.path.join(self.directory, 'direct.conf'), 'w') as fp:
+            fp.write("server { location / { proxy_pass http://127.0.0.1:8000; } }\n")
+        recipe = make_recipe(self.directory, lint='strict', input=os.path.join(self.directory, 'direct.conf'))
+        with self.assertRaises(zc.buildout.UserError):
+            recipe.install()
+        recipe = make_recipe(self.directory, lint='warn', input=os.path.join(self.directory, 'direct.conf'))
+        recipe.install()
+        self.assertTrue(recipe.manifest.get('lint'))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(zc.buildout.UserError):
+            make_recipe(self.directory, lint='pedantic')
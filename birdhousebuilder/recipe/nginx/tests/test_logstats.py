@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the access log analyzer.
+"""
+
+import os
+import gzip
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+from birdhousebuilder.recipe.nginx import logstats
+
+COMBINED = ('127.0.0.1 - - [17/Oct/2026:10:00:00 +0000] "GET /wps?service=WPS&request=GetCapabilities HTTP/1.1" '
+            '200 %d "-" "curl/7.68.0"\n')
+KV = ('time="2026-10-17T10:00:00+00:00" remote_addr="127.0.0.1" request="POST /wps HTTP/1.1" host="localhost" '
+      'status="%s" bytes_sent="100" request_length="500" request_time="%s" upstream_addr="unix:/tmp/app.sock" '
+      'upstream_connect_time="0.000" upstream_header_time="0.100" upstream_response_time="%s" '
+      'upstream_cache_status="" http_referer="" http_user_agent="owslib \\x22test\\x22"\n')
+
+
+class SketchTestCase(unittest.TestCase):
+
+    def test_quantiles_and_merge(self):
+        rnd = random.Random(42)
+        values = [rnd.expovariate(10) for _ in range(20000)]
+        left, right = logstats.Sketch(), logstats.Sketch()
+        for i, value in enumerate(values):
+            (left if i % 2 else right).add(value)
+        sketch = left.merge(right)
+        values.sort()
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q), exact, delta=exact * 0.02)
+        self.assertLess(len(sketch.buckets), 2000)
+        self.assertIsNone(logstats.Sketch().quantile(0.5))
+
+
+class LogStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_line(self):
+        record = logstats.parse_line(KV % ('200', '0.250', '0.200, 0.040'))
+        self.assertEqual(record['http_user_agent'], 'owslib "test"')
+        self.assertAlmostEqual(logstats.to_seconds(record['upstream_response_time']), 0.24)
+        record = logstats.parse_line(COMBINED % 512)
+        self.assertEqual(record['status'], '200')
+        self.assertEqual(logstats.location(record['request']), '/wps')
+        record = logstats.parse_line(json.dumps({'request': 'GET /outputs/a.nc HTTP/1.1', 'status': '206'}))
+        self.assertEqual(logstats.group_key(record, depth=2), '/outputs/a.nc')
+        self.assertIsNone(logstats.parse_line('2026/10/17 10:00:00 [error] 1#1: something'))
+
+    def test_analyze_rotated_logs(self):
+        with open(os.path.join(self.directory, 'access.log'), 'w') as fp:
+            for i in range(100):
+                fp.write(KV % ('500' if i % 10 == 0 else '200', '0.%03d' % (i + 1), '0.%03d' % i))
+        with gzip.open(os.path.join(self.directory, 'access.log.2.gz'), 'wt') as fp:
+            for i in range(50):
+                fp.write(COMBINED % 1000)
+            fp.write('garbage\n')
+        with open(os.path.join(self.directory, 'error.log'), 'w') as fp:
+            fp.write('2026/10/17 10:00:00 [error] 1#1: something\n')
+        logs = logstats.find_logs([self.directory])
+        self.assertEqual([os.path.basename(log) for log in logs], ['access.log', 'access.log.2.gz'])
+        for workers in (1, 2):
+            groups, skipped = logstats.analyze(logs, workers=workers)
+            self.assertEqual(skipped, 1)
+            report = groups['/wps'].report()
+            self.assertEqual(report['requests'], 150)
+            self.assertEqual(report['statuses'], {'200': 140, '500': 10})
+            self.assertEqual(report['bytes_sent'], 100 * 100 + 50 * 1000)
+            self.assertAlmostEqual(report['request_time_p50'], 0.05, delta=0.002)
+            self.assertAlmostEqual(report['upstream_time_p99'], 0.098, delta=0.002)
+
+    def test_corrupt_compressed_logs(self):
+        with open(os.path.join(self.directory, 'access.log'), 'w') as fp:
+            fp.write(COMBINED % 1000)
+        data = gzip.compress((COMBINED % 1000).encode('utf-8') * 1000)
+        with open(os.path.join(self.directory, 'access.log.2.gz'), 'wb') as fp:
+            fp.write(data[:len(data) // 2])
+        with open(os.path.join(self.directory, 'access.log.3.gz'), 'wb') as fp:
+            fp.write(data[:20] + b'\xff' * 200 + data[220:])
+        logs = logstats.find_logs([self.directory])
+        with self.assertLogs('nginx-logstats', 'WARNING') as cm:
+            groups, skipped = logstats.analyze(logs, workers=1)
+        self.assertEqual(len(cm.output), 2)
+        self.assertEqual(groups['/wps'].requests, 1)
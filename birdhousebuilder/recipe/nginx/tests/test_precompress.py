@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the build-time precompression of static files.
+"""
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from birdhousebuilder.recipe.nginx import _precompress
+from birdhousebuilder.recipe.nginx._render import Manifest
+
+
+class PrecompressTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.www = os.path.join(self.directory, 'www')
+        os.makedirs(os.path.join(self.www, 'static'))
+        for name in ('index.html', 'static/app.css', 'static/app.js', 'static/logo.png'):
+            with open(os.path.join(self.www, name), 'w') as fp:
+                fp.write('body { color: red; }\n' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def precompress(self):
+        manifest = Manifest(os.path.join(self.directory, 'precompress.json'))
+        count = _precompress.precompress(
+            [self.www], ['.html', '.css', '.js'], manifest, min_size=256, use_brotli=False, workers=2)
+        manifest.save()
+        return count
+
+    def test_precompress_is_incremental(self):
+        self.assertEqual(self.precompress(), 3)
+        css = os.path.join(self.www, 'static', 'app.css')
+        self.assertEqual(os.stat(css + '.gz').st_mtime, os.stat(css).st_mtime)
+        with gzip.open(css + '.gz') as fp:
+            self.assertEqual(fp.read().decode(), open(css).read())
+        self.assertFalse(os.path.exists(os.path.join(self.www, 'static', 'logo.png.gz')))
+
+        self.assertEqual(self.precompress(), 0)
+
+        with open(css, 'a') as fp:
+            fp.write('h1 { color: blue; }\n')
+        self.assertEqual(self.precompress(), 1)
+
+        os.remove(css)
+        self.assertEqual(self.precompress(), 0)
+        self.assertFalse(os.path.exists(css + '.gz'))
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the nginx recipe running against a temporary prefix.
+"""
+
+import os
+import sys
+import pwd
+import gzip
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+import mako.template
+import zc.buildout
+import zc.recipe.deployment
+
+from birdhousebuilder.recipe import nginx
+from birdhousebuilder.recipe.nginx import _render
+from birdhousebuilder.recipe.nginx import _tuning
+
+SITE_TEMPLATE = """\
+server {
+    listen ${http_port};
+    server_name ${hostname};
+}
+"""
+
+
+class Buildout(dict):
+    """Minimal stand-in for a zc.buildout instance."""
+
+    def __init__(self, directory):
+        super(Buildout, self).__init__()
+        self._raw = {}
+        self['buildout'] = {
+            'directory': directory,
+            'parts-directory': os.path.join(directory, 'parts'),
+            'bin-directory': os.path.join(directory, 'bin'),
+            'anaconda-home': os.path.join(directory, 'conda'),
+        }
+
+    def __missing__(self, key):
+        self[key] = self._raw[key]
+        return self[key]
+
+
+def make_recipe(directory, sections=None, **options):
+    user = pwd.getpwuid(os.getuid())[0]
+    input_file = os.path.join(directory, 'myapp.conf')
+    if not os.path.exists(input_file):
+        with open(input_file, 'w') as fp:
+            fp.write(SITE_TEMPLATE)
+    part_options = {
+        'name': 'myapp',
+        'prefix': os.path.join(directory, 'prefix'),
+        'user': user,
+        'etc-user': user,
+        'input': input_file,
+    }
+    part_options.update(options)
+    buildout = Buildout(directory)
+    buildout._raw.update(sections or {})
+    recipe = nginx.Recipe(buildout, 'myapp_nginx', part_options)
+    # conda and supervisor are out of scope here
+    recipe.conda.install = lambda update=False: ()
+    recipe.install_supervisor = lambda update: []
+    return recipe
+
+
+class RecipeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count_calls(self, owner, attr):
+        calls = []
+        original = getattr(owner, attr)
+
+        def wrapper(*args, **kwargs):
+            calls.append(args)
+            return original(*args, **kwargs)
+        setattr(owner, attr, wrapper)
+        self.addCleanup(setattr, owner, attr, original)
+        return calls
+
+    def test_update_unchanged_part_is_noop(self):
+        recipe = make_recipe(self.directory)
+        recipe.install()
+        conf = os.path.join(recipe.options['etc-directory'], 'nginx.conf')
+        site = os.path.join(recipe.options['etc-directory'], 'conf.d', 'myapp.conf')
+        mtimes = [os.stat(conf).st_mtime_ns, os.stat(site).st_mtime_ns]
+
+        compiled = self.count_calls(_render, 'Template')
+        written = self.count_calls(zc.recipe.deployment.Configuration, 'install')
+        for _ in range(5):
+            make_recipe(self.directory).update()
+        self.assertEqual(compiled, [])
+        self.assertEqual(written, [])
+        self.assertEqual(mtimes, [os.stat(conf).st_mtime_ns, os.stat(site).st_mtime_ns])
+
+    def test_compiled_templates_are_cached_on_disk(self):
+        recipe = make_recipe(self.directory)
+        recipe.install()
+        self.assertTrue(os.listdir(recipe.template_cache))
+        # a new buildout process starts without the in-memory templates
+        _render._templates.clear()
+        compiled = self.count_calls(mako.template, '_compile_module_file')
+        recipe = make_recipe(self.directory, **{'keepalive-timeout': '75s'})
+        recipe.update()
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            self.assertIn('keepalive_timeout 75s;', fp.read())
+        self.assertEqual(compiled, [])
+        # changed templates are compiled again
+        _render._templates.clear()
+        input_file = os.path.join(self.directory, 'myapp.conf')
+        with open(input_file, 'a') as fp:
+            fp.write('# changed\n')
+        os.utime(input_file, (time.time() + 10, time.time() + 10))
+        make_recipe(self.directory, **{'keepalive-timeout': '75s'}).update()
+        self.assertEqual(len(compiled), 1)
+
+    def test_construction_has_no_side_effects(self):
+        recipe = make_recipe(self.directory)
+        self.assertFalse(os.path.exists(recipe.options['prefix']))
+        recipe.install()
+        self.assertTrue(os.path.isdir(os.path.join(recipe.options['var-prefix'], 'tmp', 'nginx')))
+        with open(os.path.join(recipe.part_directory, 'install-timings.json')) as fp:
+            summary = json.load(fp)
+        self.assertFalse(summary['update'])
+        phases = [timing['phase'] for timing in summary['phases']]
+        self.assertEqual(phases[:3], ['deployment', 'dirs', 'conda'])
+        self.assertIn('sites', phases)
+
+    def test_update_rewrites_changed_config(self):
+        make_recipe(self.directory).install()
+        recipe = make_recipe(self.directory, **{'keepalive-timeout': '75s'})
+        recipe.update()
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            self.assertIn('keepalive_timeout 75s;', fp.read())
+
+    def test_multiple_sites(self):
+        templates = os.path.join(self.directory, 'templates')
+        os.makedirs(templates)
+        for name in ['emu.conf', 'hummingbird.conf.mako']:
+            with open(os.path.join(templates, name), 'w') as fp:
+                fp.write(SITE_TEMPLATE)
+        sections = {'flyingpigeon': {'input': os.path.join(templates, 'emu.conf'), 'hostname': 'fp.example.org'}}
+        recipe = make_recipe(self.directory, sections, input=os.path.join(templates, '*'), sites='flyingpigeon')
+        recipe.install()
+        conf_d = os.path.join(recipe.options['etc-directory'], 'conf.d')
+        self.assertEqual(sorted(os.listdir(conf_d)), ['emu.conf', 'flyingpigeon.conf', 'hummingbird.conf'])
+        with open(os.path.join(conf_d, 'flyingpigeon.conf')) as fp:
+            self.assertIn('server_name fp.example.org;', fp.read())
+
+        # undeclared sites are removed, template errors are reported together
+        with open(os.path.join(templates, 'emu.conf'), 'w') as fp:
+            fp.write('${undefined_option}\n')
+        os.utime(os.path.join(templates, 'emu.conf'), (time.time() + 10, time.time() + 10))
+        recipe = make_recipe(self.directory, sections, input=os.path.join(templates, 'emu.conf'),
+                             sites='flyingpigeon')
+        with self.assertRaises(zc.buildout.UserError) as cm:
+            recipe.update()
+        self.assertIn('myapp.conf', str(cm.exception))
+        self.assertIn('flyingpigeon.conf', str(cm.exception))
+        self.assertEqual(os.listdir(conf_d), ['flyingpigeon.conf'])
+
+    def test_site_overrides(self):
+        template = os.path.join(self.directory, 'service.conf')
+        with open(template, 'w') as fp:
+            fp.write("${upstream}\nserver {\n    listen ${http_listen};\n    ${limit_req}\n"
+                     "    location / { proxy_pass http://${upstream_name}; }\n}\n")
+        sections = {
+            'emu': {'input': template, 'http-port': '8094', 'upstream-servers': 'unix:///tmp/emu.sock'},
+            'flyingpigeon': {'input': template, 'http_port': '8093', 'upstream-servers': '127.0.0.1:5000',
+                             'limit-req-zones': 'fp rate=5r/s'},
+        }
+        recipe = make_recipe(self.directory, sections, input='', sites='emu flyingpigeon')
+        recipe.install()
+        conf_d = os.path.join(recipe.options['etc-directory'], 'conf.d')
+        with open(os.path.join(conf_d, 'emu.conf')) as fp:
+            emu = fp.read()
+        with open(os.path.join(conf_d, 'flyingpigeon.conf')) as fp:
+            flyingpigeon = fp.read()
+        self.assertIn('listen 8094;', emu)
+        self.assertIn('upstream emu {', emu)
+        self.assertIn('server unix:///tmp/emu.sock', emu)
+        self.assertIn('proxy_pass http://emu;', emu)
+        self.assertNotIn('limit_req', emu)
+        self.assertIn('listen 8093;', flyingpigeon)
+        self.assertIn('upstream flyingpigeon {', flyingpigeon)
+        self.assertIn('server 127.0.0.1:5000', flyingpigeon)
+        self.assertIn('limit_req zone=fp burst=20;', flyingpigeon)
+        # zones of the sites are declared in nginx.conf
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            self.assertIn('limit_req_zone $binary_remote_addr zone=fp:', fp.read())
+
+        sections['emu']['limit-req-zones'] = 'fp rate=1r/s'
+        with self.assertRaises(zc.buildout.UserError):
+            make_recipe(self.directory, sections, input='', sites='emu flyingpigeon')
+
+    def test_outputs(self):
+        recipe = make_recipe(self.directory, **{
+            'outputs-root': os.path.join(self.directory, 'outputs'), 'outputs-upstream': 'http://127.0.0.1:8090'})
+        recipe.install()
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            text = fp.read()
+        self.assertIn('thread_pool outputs threads=16 max_queue=65536;', text)
+        self.assertIn('keys_zone=outputs:10m use_temp_path=off inactive=7d max_size=10g;', text)
+        self.assertTrue(os.path.isdir(os.path.join(recipe.options['cache-directory'], 'outputs')))
+        self.assertIn('slice 1m;', recipe.options['outputs'])
+
+    def test_temp_paths_and_buffering(self):
+        recipe = make_recipe(self.directory, **{
+            'client-max-body-size': '2g', 'proxy-buffers': '16 16k', 'proxy-request-buffering': 'off'})
+        recipe.install()
+        temp_directory = os.path.join(recipe.options['var-prefix'], 'tmp', 'nginx')
+        self.assertTrue(os.path.isdir(os.path.join(temp_directory, 'client_body')))
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            text = fp.read()
+        self.assertIn('client_body_temp_path %s/client_body 1 2;' % temp_directory, text)
+        self.assertIn('client_max_body_size 2g;', text)
+        self.assertIn('proxy_buffers 16 16k;', text)
+        self.assertIn('proxy_request_buffering off;', text)
+        self.assertNotIn('proxy_buffer_size', text)
+        self.assertTrue(recipe.supervisor_command().startswith(recipe.options['conda-prefix']))
+        recipe = make_recipe(self.directory, **{'temp-tmpfs': 'true'})
+        self.assertEqual(recipe.options['temp-directory'], '/dev/shm/nginx-myapp')
+        command = recipe.supervisor_command()
+        self.assertTrue(command.startswith("/bin/sh -c 'mkdir -p /dev/shm/nginx-myapp && exec "))
+        self.assertTrue(command.endswith(' -g "daemon off;"\''))
+
+    def test_auto_tune(self):
+        tuned = _tuning.auto_tune(cpus=32, nofile=1048576, platform='linux')
+        self.assertEqual(tuned['worker-processes'], '32')
+        self.assertEqual(tuned['worker-rlimit-nofile'], '65536')
+        self.assertEqual(tuned['worker-connections'], '16384')
+        recipe = make_recipe(self.directory, **{'auto-tune': 'true', 'worker-connections': '4096'})
+        recipe.install()
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            text = fp.read()
+        self.assertIn('worker_processes %s;' % _tuning.cpu_count(), text)
+        self.assertIn('worker_connections 4096;', text)
+        self.assertIn('multi_accept on;', text)
+
+    def test_static_profile(self):
+        recipe = make_recipe(self.directory, **{'static-profile': 'default', 'open-file-cache-max': '500'})
+        recipe.install()
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            text = fp.read()
+        self.assertIn('sendfile on;', text)
+        self.assertIn('tcp_nopush on;', text)
+        self.assertIn('open_file_cache max=500 inactive=20s;', text)
+        self.assertNotIn('output_buffers', text)
+
+    def test_ec_cert_is_reissued_with_same_key(self):
+        recipe = make_recipe(self.directory, **{
+            'ssl-key-type': 'ec', 'ssl-cert-days': '10', 'ssl-subject-alt-names': 'example.org 127.0.0.1'})
+        recipe.install()
+        certfile = os.path.join(recipe.options['etc-directory'], 'cert.pem')
+        self.assertEqual(os.stat(certfile).st_mode & 0o777, 0o600)
+        cert, key = nginx.read_cert(certfile)
+        self.assertEqual(nginx.key_type_of(key), 'ec')
+        self.assertEqual(len(cert.extensions[0].value), 3)
+
+        recipe = make_recipe(self.directory, **{'ssl-key-type': 'ec', 'ssl-cert-renew-days': '30'})
+        recipe.update()
+        new_cert, new_key = nginx.read_cert(certfile)
+        self.assertNotEqual(new_cert.serial_number, cert.serial_number)
+        self.assertEqual(new_key.private_numbers(), key.private_numbers())
+
+    def test_cert_is_reissued_for_changed_key_type_and_names(self):
+        recipe = make_recipe(self.directory)
+        recipe.install()
+        certfile = os.path.join(recipe.options['etc-directory'], 'cert.pem')
+        cert, key = nginx.read_cert(certfile)
+        self.assertEqual(nginx.key_type_of(key), 'rsa')
+
+        recipe = make_recipe(self.directory)
+        recipe.update()
+        self.assertEqual(nginx.read_cert(certfile)[0].serial_number, cert.serial_number)
+
+        recipe = make_recipe(self.directory, **{'ssl-key-type': 'ec'})
+        recipe.update()
+        cert, key = nginx.read_cert(certfile)
+        self.assertEqual(nginx.key_type_of(key), 'ec')
+
+        recipe = make_recipe(self.directory, **{'ssl-key-type': 'ec', 'ssl-subject-alt-names': 'example.org'})
+        recipe.update()
+        new_cert, new_key = nginx.read_cert(certfile)
+        self.assertNotEqual(new_cert.serial_number, cert.serial_number)
+        self.assertEqual(new_key.private_numbers(), key.private_numbers())
+        self.assertTrue(nginx.cert_matches(new_cert, recipe.options['hostname'], ['example.org']))
+
+    def test_tls_options(self):
+        options = {
+            'ssl-session-cache': 'shared:SSL:50m', 'ssl-session-timeout': '4h', 'ssl-session-tickets': 'on',
+            'ssl-session-ticket-key': 'ticket.key', 'ssl-stapling': 'on', 'resolver': '127.0.0.53 valid=300s',
+            'ssl-buffer-size': '16k', 'http2': 'true'}
+        recipe = make_recipe(self.directory, **options)
+        self.assertEqual(recipe.options['https_listen'], '443 ssl http2')
+        recipe.install()
+        with open(os.path.join(recipe.options['etc-directory'], 'nginx.conf')) as fp:
+            text = fp.read()
+        keyfile = os.path.join(recipe.options['etc-directory'], 'ticket.key')
+        self.assertIn('ssl_session_cache shared:SSL:50m;', text)
+        self.assertIn('ssl_session_timeout 4h;', text)
+        self.assertIn('ssl_session_tickets on;', text)
+        self.assertIn('ssl_session_ticket_key %s;' % keyfile, text)
+        self.assertIn('ssl_buffer_size 16k;', text)
+        self.assertIn('ssl_stapling on;', text)
+        self.assertIn('ssl_stapling_verify on;', text)
+        self.assertIn('ssl_trusted_certificate %s;' % os.path.join(
+            recipe.options['etc-directory'], 'cert_chain.crt'), text)
+        self.assertIn('resolver 127.0.0.53 valid=300s;', text)
+
+        self.assertEqual(os.stat(keyfile).st_mode & 0o777, 0o600)
+        with open(keyfile, 'rb') as fp:
+            key = fp.read()
+        self.assertEqual(len(key), 80)
+        # the key is kept on update, so that issued tickets stay valid
+        make_recipe(self.directory, **options).update()
+        with open(keyfile, 'rb') as fp:
+            self.assertEqual(fp.read(), key)
+
+    def test_rotate_logs(self):
+        recipe = make_recipe(self.directory, **{'access-log-gzip': '1', 'log-rotate-keep': '2'})
+        recipe.install()
+        script = os.path.join(recipe.options['etc-directory'], 'nginx-rotate-logs.sh')
+        self.assertTrue(os.access(script, os.X_OK))
+        log_directory = recipe.options['log-directory']
+        access_log = gzip.compress(b'GET / 200\n')
+        for _ in range(3):
+            with open(os.path.join(log_directory, 'access.log'), 'wb') as fp:
+                fp.write(access_log)
+            with open(os.path.join(log_directory, 'error.log'), 'w') as fp:
+                fp.write('[error] something\n')
+            subprocess.check_call(['sh', script])
+        self.assertEqual(sorted(os.listdir(log_directory)), [
+            'access.log.1.gz', 'access.log.2.gz', 'error.log.1.gz', 'error.log.2.gz'])
+        # the access log written with gzip by nginx is not compressed again
+        with open(os.path.join(log_directory, 'access.log.1.gz'), 'rb') as fp:
+            self.assertEqual(fp.read(), access_log)
+        with gzip.open(os.path.join(log_directory, 'error.log.2.gz'), 'rt') as fp:
+            self.assertEqual(fp.read(), '[error] something\n')
+
+    def test_rotate_logs_after_interrupted_run(self):
+        recipe = make_recipe(self.directory, **{'log-rotate-keep': '3'})
+        recipe.install()
+        script = os.path.join(recipe.options['etc-directory'], 'nginx-rotate-logs.sh')
+        log_directory = recipe.options['log-directory']
+        # pid of a process which has exited
+        process = subprocess.Popen(['true'])
+        process.wait()
+        with open(os.path.join(recipe.options['run-directory'], 'nginx.pid'), 'w') as fp:
+            fp.write('%d\n' % process.pid)
+        # left uncompressed by a run which failed after renaming the logs
+        with open(os.path.join(log_directory, 'error.log.1'), 'w') as fp:
+            fp.write('[error] first\n')
+        with open(os.path.join(log_directory, 'error.log'), 'w') as fp:
+            fp.write('[error] second\n')
+        subprocess.check_call(['sh', script])
+        self.assertEqual(sorted(os.listdir(log_directory)), ['error.log.1.gz', 'error.log.2.gz'])
+        with gzip.open(os.path.join(log_directory, 'error.log.2.gz'), 'rt') as fp:
+            self.assertEqual(fp.read(), '[error] first\n')
+        with gzip.open(os.path.join(log_directory, 'error.log.1.gz'), 'rt') as fp:
+            self.assertEqual(fp.read(), '[error] second\n')
+
+    def test_changed_config_is_reloaded(self):
+        # stand-in for the nginx binary and a running master process
+        conda_prefix = os.path.join(self.directory, 'conda')
+        os.makedirs(os.path.join(conda_prefix, 'sbin'))
+        environ = mock.patch.dict(os.environ, {'CONDA_PREFIX': conda_prefix})
+        environ.start()
+        self.addCleanup(environ.stop)
+        nginx_bin = os.path.join(conda_prefix, 'sbin', 'nginx')
+        with open(nginx_bin, 'w') as fp:
+            fp.write('#!/bin/sh\necho "nginx version: nginx/1.19.6"\n')
+        os.chmod(nginx_bin, 0o755)
+        hup_file = os.path.join(self.directory, 'hup')
+        master = subprocess.Popen([
+            sys.executable, '-c',
+            'import signal, time\n'
+            'signal.signal(signal.SIGHUP, lambda *args: open(%r, "w").close())\n'
+            'time.sleep(30)\n' % hup_file])
+        self.addCleanup(master.wait)
+        self.addCleanup(master.kill)
+
+        recipe = make_recipe(self.directory)
+        recipe.install()
+        self.assertEqual(recipe.reload_status, 'changed')
+        with open(os.path.join(recipe.options['run-directory'], 'nginx.pid'), 'w') as fp:
+            fp.write('%d\n' % master.pid)
+
+        recipe = make_recipe(self.directory)
+        recipe.update()
+        self.assertEqual(recipe.reload_status, 'unchanged')
+        recipe = make_recipe(self.directory, **{'keepalive-timeout': '75s'})
+        recipe.update()
+        self.assertEqual(recipe.reload_status, 'reloaded')
+        for _ in range(50):
+            if os.path.exists(hup_file):
+                break
+            time.sleep(0.1)
+        self.assertTrue(os.path.exists(hup_file))
+
+        # a new nginx version under supervisord is restarted, not upgraded on the fly
+        self.assertFalse(nginx._control.supervised(master.pid))
+        with open(nginx_bin, 'w') as fp:
+            fp.write('#!/bin/sh\necho "nginx version: nginx/1.21.0"\n')
+        supervisorctl = os.path.join(self.directory, 'bin', 'supervisorctl')
+        os.makedirs(os.path.dirname(supervisorctl))
+        with open(supervisorctl, 'w') as fp:
+            fp.write('#!/bin/sh\necho "$@" > %s\n' % os.path.join(self.directory, 'restarted'))
+        os.chmod(supervisorctl, 0o755)
+        recipe = make_recipe(self.directory, **{'keepalive-timeout': '75s', 'binary-upgrade': 'true'})
+        with mock.patch.object(nginx._control, 'supervised', return_value=True):
+            recipe.update()
+        self.assertEqual(recipe.reload_status, 'restarted')
+        with open(os.path.join(self.directory, 'restarted')) as fp:
+            self.assertEqual(fp.read(), 'restart nginx\n')
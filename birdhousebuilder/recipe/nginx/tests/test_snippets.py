@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the generated nginx configuration snippets.
+"""
+
+import unittest
+
+import zc.buildout
+
+from birdhousebuilder.recipe.nginx import _snippets
+
+
+class UpstreamTestCase(unittest.TestCase):
+
+    def test_split_servers(self):
+        self.assertEqual(
+            _snippets.split_servers('127.0.0.1:8091 weight=2\nunix:/tmp/app.socket backup'),
+            ['127.0.0.1:8091 weight=2', 'unix:/tmp/app.socket backup'])
+
+    def test_upstream_block(self):
+        text = _snippets.upstream_block(
+            'myapp', ['127.0.0.1:8091', '127.0.0.1:8092 max_fails=3'], balance='hash $request_uri')
+        self.assertIn('zone upstream_myapp 64k;', text)
+        self.assertIn('hash $request_uri consistent;', text)
+        self.assertIn('server 127.0.0.1:8091 max_fails=1 fail_timeout=10s;', text)
+        self.assertIn('server 127.0.0.1:8092 max_fails=3 fail_timeout=10s;', text)
+        self.assertIn('keepalive 32;', text)
+
+    def test_upstream_block_without_keepalive(self):
+        text = _snippets.upstream_block('myapp', ['127.0.0.1:8091'], balance='least_conn', keepalive=0)
+        self.assertIn('least_conn;', text)
+        self.assertNotIn('keepalive', text)
+
+    def test_proxy_streaming(self):
+        # combined with proxy_keepalive in one location, the directives must not repeat
+        lines = (_snippets.proxy_keepalive() + '\n' + _snippets.proxy_streaming()).splitlines()
+        self.assertEqual(len(set(line.split()[0] for line in lines)), len(lines))
+        self.assertIn('proxy_request_buffering off;', lines)
+
+    def test_unknown_balance(self):
+        with self.assertRaises(zc.buildout.UserError):
+            _snippets.upstream_block('myapp', ['127.0.0.1:8091'], balance='fastest')
+
+
+class AccessLogTestCase(unittest.TestCase):
+
+    def test_log_format(self):
+        self.assertIn('"request_time":"$request_time"', _snippets.log_format('timed', 'json'))
+        self.assertIn('upstream_response_time="$upstream_response_time"', _snippets.log_format('timed', 'kv'))
+        with self.assertRaises(zc.buildout.UserError):
+            _snippets.log_format('timed', 'xml')
+
+    def test_access_log(self):
+        self.assertEqual(
+            _snippets.access_log('/var/log/nginx/access.log', 'timed', buffer='64k', flush='5s',
+                                 condition='$access_log_sampled'),
+            'access_log /var/log/nginx/access.log timed buffer=64k flush=5s if=$access_log_sampled;')
+
+
+class LimitTestCase(unittest.TestCase):
+
+    def test_zone_size(self):
+        self.assertEqual(_snippets.zone_size(10000, 128), '2m')
+        self.assertEqual(_snippets.zone_size(100, 64), '32k')
+        self.assertEqual(_snippets.zone_size(1000, 128), '157k')
+
+    def test_limit_req_zones(self):
+        zones = _snippets.limit_zones(
+            'wps rate=5r/s burst=10 nodelay clients=50000\napi $http_x_api_key status=503', 'req')
+        self.assertEqual(_snippets.limit_zone(*zones[0] + ('req',)),
+                         'limit_req_zone $binary_remote_addr zone=wps:8m rate=5r/s;')
+        self.assertEqual(_snippets.limit('wps', zones[0][2], 'req'), 'limit_req zone=wps burst=10 nodelay;')
+        self.assertEqual(_snippets.limit_zone(*zones[1] + ('req',)),
+                         'limit_req_zone $http_x_api_key zone=api:4m rate=10r/s;')
+        self.assertEqual(_snippets.limit('api', zones[1][2], 'req'),
+                         'limit_req zone=api burst=20;\nlimit_req_status 503;')
+
+    def test_limit_conn_zones(self):
+        zones = _snippets.limit_zones('perip conn=4 size=1m', 'conn')
+        self.assertEqual(_snippets.limit_zone(*zones[0] + ('conn',)),
+                         'limit_conn_zone $binary_remote_addr zone=perip:1m;')
+        self.assertEqual(_snippets.limit('perip', zones[0][2], 'conn'), 'limit_conn perip 4;')
+
+    def test_invalid_limit_zones(self):
+        with self.assertRaises(zc.buildout.UserError):
+            _snippets.limit_zones('wps rate=fast', 'req')
+        with self.assertRaises(zc.buildout.UserError):
+            _snippets.limit_zones('wps nodelay', 'conn')
+
+
+class OutputsTestCase(unittest.TestCase):
+
+    def test_outputs_from_root(self):
+        text = _snippets.outputs_locations('/data/outputs/', '/outputs', '/_outputs')
+        self.assertIn('location ^~ /_outputs/ {\n    internal;\n    alias /data/outputs/;', text)
+        self.assertIn('location ^~ /outputs/ {\n    alias /data/outputs/;', text)
+        self.assertEqual(text.count('aio threads=outputs;'), 2)
+        self.assertIn('directio 4m;', text)
+
+    def test_outputs_slice_cache(self):
+        text = _snippets.outputs_locations(
+            '/data/outputs', '/outputs', '/_outputs', upstream='http://thredds:8080', slice_size='1m',
+            cache_zone='outputs')
+        self.assertIn('slice 1m;', text)
+        self.assertIn('proxy_cache_key $uri$is_args$args$slice_range;', text)
+        self.assertIn('proxy_pass http://thredds:8080;', text)
+
+
+    def test_proxy_cache_requests(self):
+        self.assertEqual(_snippets.proxy_cache_map('GetCapabilities DescribeProcess'), '\n'.join([
+            'map $arg_request $proxy_cache_skip {',
+            '    default 1;',
+            '    "~*^(GetCapabilities|DescribeProcess)$" 0;',
+            '}']))
+        self.assertEqual(_snippets.proxy_cache_map(''), '')
+        self.assertEqual(_snippets.proxy_cache('wps', '200 10m', _snippets.PROXY_CACHE_SKIP).splitlines(), [
+            'proxy_cache wps;',
+            'proxy_cache_bypass $proxy_cache_skip;',
+            'proxy_no_cache $proxy_cache_skip;',
+            'add_header X-Cache-Status $upstream_cache_status;',
+            'proxy_cache_valid 200 10m;'])
+        self.assertNotIn('proxy_no_cache', _snippets.proxy_cache('wps', '200 10m'))
+
+
+class StaticCacheTestCase(unittest.TestCase):
+
+    def test_expires_map(self):
+        text = _snippets.expires_map('text/html 5m\nimage/ 30d')
+        self.assertTrue(text.startswith('map $sent_http_content_type $expires_by_type {\n    default off;\n'
+                                        '    ~^text/html 5m;\n    ~^image/ 30d;\n}\n'))
+        self.assertIn('map $uri $expires {\n    default $expires_by_type;\n}', text)
+        with self.assertRaises(zc.buildout.UserError):
+            _snippets.expires_map('text/html')
+
+    def test_static_cache(self):
+        text = _snippets.expires_map('text/css 7d', r'\.[0-9a-f]{8,}\.(css|js)$')
+        # fingerprinted files get one Cache-Control header, not a second one from expires
+        self.assertIn('    "~*\\.[0-9a-f]{8,}\\.(css|js)$" off;', text)
+        self.assertIn('    "~*\\.[0-9a-f]{8,}\\.(css|js)$" "public, max-age=31536000, immutable";', text)
+        self.assertEqual(_snippets.static_cache(),
+                         'expires $expires;\nadd_header Cache-Control $static_cache_control;')
+        self.assertNotIn('location', _snippets.static_cache())
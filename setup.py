@@ -21,16 +21,23 @@ entry_points = '''
 default = %(name)s:Recipe
 [zc.buildout.uninstall]
 default = %(name)s:uninstall
+[console_scripts]
+nginx-cache = %(name)s.cache:main
+nginx-benchmark = %(name)s.benchmark:main
+nginx-exporter = %(name)s.exporter:main
+nginx-lint = %(name)s.lint:main
+nginx-logstats = %(name)s.logstats:main
 ''' % globals()
 
 reqs = ['setuptools',
         'zc.buildout',
         # -*- Extra requirements: -*-
         'mako',
-        'pyopenssl',
+        'cryptography',
         'zc.recipe.deployment',
         'birdhousebuilder.recipe.conda',
         'birdhousebuilder.recipe.supervisor',
+        'zc.recipe.egg',
         ],
 tests_reqs = ['zope.testing', 'zc.buildout']
 